@@ -0,0 +1,39 @@
+﻿"""
+Compares the binning routines to NumPy's histogram functions.
+
+Bins normally distributed samples, with N ranging from 10⁴ to 10⁸, on
+the default grids of `kde1d` and `kde2d`, and prints the run times as
+well as the speed-up. Pass the highest power of ten as a command-line
+argument to go beyond that, e.g. 9 for a billion samples, which needs
+about 20 GB of memory.
+"""
+
+from kde_diffusion.binning import histogram, histogram2d
+import numpy
+from numpy.random import default_rng
+from time import perf_counter
+import sys
+
+
+def timed(function, *arguments):
+    start = perf_counter()
+    function(*arguments)
+    return perf_counter() - start
+
+
+highest = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+random = default_rng(0)
+
+print(f'{"N":>6}  {"histogram":>20}  {"histogram2d":>20}')
+for power in range(4, highest+1):
+    N = 10**power
+    x = random.normal(size=N)
+    y = random.normal(size=N)
+    limits = (-5, +5)
+    before = timed(numpy.histogram, x, 1024, limits)
+    after  = timed(histogram, x, 1024, limits)
+    line = f'10^{power:<3}  {after:8.3f} s {before/after:8.1f}×'
+    before = timed(numpy.histogram2d, x, y, 256, (limits, limits))
+    after  = timed(histogram2d, x, y, 256, (limits, limits))
+    line += f'  {after:8.3f} s {before/after:8.1f}×'
+    print(line)
@@ -0,0 +1,37 @@
+﻿"""
+Compares the two policies for rounding up the grid size in `kde2d`.
+
+Estimates the density of 10⁵ normally distributed samples on square
+grids of various requested sizes, with the size rounded up to the next
+power of two and to the next fast transform length, respectively, and
+prints the actual size, run time, and peak memory use of both.
+"""
+
+from kde_diffusion import kde2d
+from numpy.random import default_rng
+from time import perf_counter
+import tracemalloc
+
+
+def measured(function, *arguments, **keywords):
+    tracemalloc.start()
+    start = perf_counter()
+    function(*arguments, **keywords)
+    time = perf_counter() - start
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (time, peak/2**20)
+
+
+random = default_rng(0)
+x = random.normal(size=100_000)
+y = random.normal(size=100_000)
+
+print(f'{"n":>6}  {"power of two":>28}  {"fast length":>28}')
+for n in (300, 600, 1100, 1500, 2100, 3000):
+    line = f'{n:>6}'
+    for rounding in ('power', 'fast'):
+        (density, grid, _) = kde2d(x, y, n, 5, rounding=rounding)
+        (time, memory) = measured(kde2d, x, y, n, 5, rounding=rounding)
+        line += f'  {len(grid[0]):>6}  {time:8.3f} s  {memory:7.0f} MB'
+    print(line)
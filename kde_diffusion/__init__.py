@@ -1,5 +1,20 @@
 ﻿# The imports here define the public interface of the package.
 from .kde1d import kde1d
 from .kde2d import kde2d
+from .kdend import kdend
+from .kde1d import kde1d_binned
+from .kde2d import kde2d_binned
+from .batch import kde1d_batch
+from .batch import kde2d_batch
+from .chunked import kde1d_chunked
+from .chunked import kde2d_chunked
+from .streaming import StreamingKDE1d
+from .streaming import SlidingKDE1d
+from .streaming import DecayedKDE1d
+from .sketch import Sketch1d
+from .sketch import Sketch2d
+from .fitted import KDE1d
+from .fitted import KDE2d
+from .workspace import Workspace
 from .meta  import version as __version__
 from .meta  import summary as __doc__
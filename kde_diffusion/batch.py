@@ -0,0 +1,249 @@
+﻿"""Kernel density estimation via diffusion for many data sets at once."""
+
+
+########################################
+# Dependencies                         #
+########################################
+from .binning import histogram, histogram2d
+from .solver import roots
+from .kde1d import bounds as bounds1d
+from .kde2d import bounds as bounds2d, functionals
+from .constants import powers, doubles, factors
+from numpy import asarray, arange, concatenate, repeat, full, empty, stack
+from numpy import einsum
+from numpy import minimum, maximum
+from numpy import exp, sqrt, pi as π
+from numpy import ceil, log2
+from scipy.fft import dct, idct, dctn, idctn
+
+
+########################################
+# 1d                                   #
+########################################
+
+def kde1d_batch(samples, n=1024, limits=None, workers=None):
+    """
+    Estimates the 1d densities of many data sets in one go.
+
+    `samples` is either a 2d array with one data set per row, or a
+    list of lists/arrays that may differ in length. Each data set is
+    treated exactly as the input `x` of [`kde1d`](#kde1d), with the
+    grid size `n` and the `limits`, in any of the forms accepted there,
+    applying to all of them. Limits that are `None` are inferred from
+    each data set individually.
+
+    Instead of looping over the data sets, all of them are binned
+    together, transformed together, and their optimal diffusion times
+    are found by a vectorized root search. This is much faster than
+    separate calls if there are many data sets with few samples each.
+    The binning and transforms can be split among several threads,
+    given by `workers`, just like for `kde1d`.
+
+    Returns the estimated `density` and the `grid` as 2d arrays, with
+    one row per data set, as well as the optimal `bandwidth` values as
+    a 1d array. Raises `ValueError` if the algorithm did not converge
+    for any of the data sets or if one of them is empty.
+    """
+
+    # Flatten all data sets into one array, remembering their origin.
+    if isinstance(samples, list):
+        samples = [asarray(x) for x in samples]
+        sizes   = asarray([len(x) for x in samples])
+        values  = concatenate(samples) if samples else asarray([])
+    else:
+        samples = asarray(samples)
+        (m, N)  = samples.shape
+        sizes   = full(m, N)
+        values  = samples.ravel()
+    m = len(sizes)
+    if (sizes == 0).any():
+        raise ValueError('Data sets must not be empty.')
+    rows = repeat(arange(m), sizes)
+    N = sizes
+
+    # Round up number of bins to next power of two.
+    n = int(2**ceil(log2(n)))
+
+    # Determine missing data limits.
+    (xmin, xmax) = bounds1d(limits)
+    if None in (xmin, xmax):
+        starts = concatenate(([0], sizes.cumsum()[:-1]))
+        lowest  = minimum.reduceat(values, starts)
+        highest = maximum.reduceat(values, starts)
+        delta = highest - lowest
+    xmin = lowest  - delta/10 if xmin is None else full(m, xmin, dtype=float)
+    xmax = highest + delta/10 if xmax is None else full(m, xmax, dtype=float)
+    Δx = xmax - xmin
+
+    # Bin samples on regular grids.
+    (binned, edges) = histogram(values, n, (xmin, xmax), rows, workers)
+    grid = edges[:, :-1]
+
+    # Compute discrete cosine transforms, then adjust first components.
+    transformed = dct(binned / N[:, None], workers=workers)
+    transformed[:, 0] /= 2
+
+    # Pre-compute squared indices and, for each order l of the solver
+    # loop below, the weighted transform components that enter the sum.
+    k2l = powers(n)
+    k2  = k2l[1]
+    a2  = (transformed/2)**2
+    moments = empty((8, m, n))
+    for l in range(2, 8):
+        moments[l] = 2*π**(2*l) * k2l[l] * a2
+
+    def Σ(l, t, rows):
+        """Returns the sums over all components of order l at times t."""
+        decay = exp(-π**2 * k2 * t[:, None])
+        return einsum('ij,ij->i', moments[l, rows], decay)
+
+    # Define internal function to be solved iteratively for selected rows.
+    (Ks, Cs) = (doubles / sqrt(2*π), factors(1))
+
+    def ξγ(t, rows, l=7):
+        """Returns ξ γ^[l] as a function of diffusion times t."""
+        Nr = N[rows]
+        f = Σ(l, t, rows)
+        for s in range(l-1, 1, -1):
+            (K, C) = (Ks[s], Cs[s])
+            t = (2*C*K/Nr/f)**(2/(3+2*s))
+            f = Σ(s, t, rows)
+        return (2*Nr*sqrt(π)*f)**(-2/5)
+
+    # Solve for optimal diffusion times t*.
+    try:
+        ts = roots(lambda t, rows: t - ξγ(t, rows), full(m, 0.), full(m, 0.1))
+    except ValueError:
+        raise ValueError('Bandwidth optimization did not converge.') from None
+
+    # Apply Gaussian filters with optimized kernels.
+    smoothed = transformed * exp(-π**2 * ts[:, None]/2 * k2)
+
+    # Reverse transformation after adjusting first components.
+    smoothed[:, 0] *= 2
+    inverse = idct(smoothed, workers=workers)
+
+    # Normalize densities.
+    density = inverse * (n/Δx)[:, None]
+
+    # Determine bandwidths from diffusion times.
+    bandwidth = sqrt(ts) * Δx
+
+    # Return results.
+    return (density, grid, bandwidth)
+
+
+########################################
+# 2d                                   #
+########################################
+
+def kde2d_batch(samples, n=256, limits=None, workers=None):
+    """
+    Estimates the 2d densities of many data sets in one go.
+
+    `samples` is a sequence of data sets, each a pair of lists/arrays
+    `(x, y)` holding the coordinates of the observations, just like the
+    input of [`kde2d`](#kde2d). The number of observations may differ
+    between data sets. The grid size `n` and the `limits`, in any of
+    the forms accepted by `kde2d`, apply to all data sets. Limits that
+    are `None` are inferred from each data set individually.
+
+    All data sets are binned together into a stack of histograms. The
+    transforms then run over the last two axes of that stack, and the
+    optimal diffusion times of all data sets are solved for at once.
+    The binning and transforms can be split among several `workers`.
+
+    Returns the estimated `density` as a 3d array, with the first index
+    referring to the data set, the `grid` as a tuple of 2d arrays, with
+    one row per data set, and the `bandwidth` values as a 2d array, with
+    one row of x- and y-bandwidth per data set. Raises `ValueError` if
+    the algorithm did not converge for any of the data sets, or if `x`
+    and `y` of a data set are empty or not the same length.
+    """
+
+    # Flatten all data sets into two arrays, remembering their origin.
+    xs = [asarray(x) for (x, _) in samples]
+    ys = [asarray(y) for (_, y) in samples]
+    sizes = asarray([len(x) for x in xs])
+    if any(len(y) != N for (y, N) in zip(ys, sizes)):
+        raise ValueError('x and y must have the same length.')
+    if (sizes == 0).any():
+        raise ValueError('Data sets must not be empty.')
+    m = len(sizes)
+    x = concatenate(xs)
+    y = concatenate(ys)
+    rows = repeat(arange(m), sizes)
+    starts = concatenate(([0], sizes.cumsum()[:-1]))
+    N = sizes
+
+    # Round up number of bins to next power of two.
+    n = int(2**ceil(log2(n)))
+
+    # Determine missing data limits.
+    ((xmin, xmax), (ymin, ymax)) = bounds2d(limits)
+    if None in (xmin, xmax):
+        lowest  = minimum.reduceat(x, starts)
+        highest = maximum.reduceat(x, starts)
+        delta = highest - lowest
+    xmin = lowest  - delta/4 if xmin is None else full(m, xmin, dtype=float)
+    xmax = highest + delta/4 if xmax is None else full(m, xmax, dtype=float)
+    if None in (ymin, ymax):
+        lowest  = minimum.reduceat(y, starts)
+        highest = maximum.reduceat(y, starts)
+        delta = highest - lowest
+    ymin = lowest  - delta/4 if ymin is None else full(m, ymin, dtype=float)
+    ymax = highest + delta/4 if ymax is None else full(m, ymax, dtype=float)
+    Δx = xmax - xmin
+    Δy = ymax - ymin
+
+    # Bin samples on regular grids.
+    (binned, (xedges, yedges)) = histogram2d(x, y, n,
+                                             ((xmin, xmax), (ymin, ymax)),
+                                             rows, workers)
+    grid = (xedges[:, :-1], yedges[:, :-1])
+
+    # Compute discrete cosine transforms, then adjust first components.
+    transformed = dctn(binned / N[:, None, None], axes=(-2, -1),
+                       workers=workers)
+    transformed[:, 0, :] /= 2
+    transformed[:, :, 0] /= 2
+
+    # Pre-compute squared indices and transform components before solver loop.
+    k2 = powers(n)[1]
+    a2 = transformed**2
+
+    # Define internal function to be solved iteratively for selected rows.
+    def γ(t, rows):
+        (ψ02, ψ11, ψ20) = functionals(t, N[rows], a2[rows], k2)
+        Σ = ψ02 + ψ20 + 2*ψ11
+        γ = (2*π*N[rows]*Σ)**(-1/3)
+        return (t - γ) / γ
+
+    # Solve for optimal diffusion times t*.
+    try:
+        ts = roots(lambda t, rows: t - γ(t, rows), full(m, 0.), full(m, 0.1))
+    except ValueError:
+        raise ValueError('Bandwidth optimization did not converge.') from None
+
+    # Calculate diffusion times along x- and y-axis.
+    (ψ02, ψ11, ψ20) = functionals(ts, N, a2, k2)
+    tx1 = (ψ02**(3/4) / (4*π*N*ψ20**(3/4) * (ψ11 + sqrt(ψ02*ψ20))) )**(1/3)
+    tx2 = (ψ20**(3/4) / (4*π*N*ψ02**(3/4) * (ψ11 + sqrt(ψ02*ψ20))) )**(1/3)
+
+    # Apply Gaussian filters with optimized kernels.
+    smoothed = transformed * (exp(-π**2 * k2 * tx2[:, None]/2)[:, :, None]
+                              * exp(-π**2 * k2 * tx1[:, None]/2)[:, None, :])
+
+    # Reverse transformation after adjusting first components.
+    smoothed[:, 0, :] *= 2
+    smoothed[:, :, 0] *= 2
+    inverse = idctn(smoothed, axes=(-2, -1), workers=workers)
+
+    # Normalize densities.
+    density = inverse * (n/Δx * n/Δy)[:, None, None]
+
+    # Determine bandwidths from diffusion times.
+    bandwidth = stack([sqrt(tx2)*Δx, sqrt(tx1)*Δy], axis=-1)
+
+    # Return results.
+    return (density, grid, bandwidth)
@@ -0,0 +1,296 @@
+﻿"""Binning of samples on regular grids."""
+
+
+########################################
+# Dependencies                         #
+########################################
+from numpy import asarray, linspace, zeros, bincount, intp
+from numpy import abs, maximum, finfo, add
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
+from scipy.fft import get_workers
+
+
+########################################
+# Settings                             #
+########################################
+
+block = 2**16
+"""
+Number of samples binned at a time, keeping temporary arrays small.
+Larger grids are binned in blocks of their own size, as each block's
+counts are added to the total.
+"""
+
+
+########################################
+# Histograms                           #
+########################################
+
+def histogram(x, bins, limits, rows=None, workers=None, out=None):
+    """
+    Bins the samples `x` on a regular grid of `bins` intervals.
+
+    The grid extends over the `limits`, a tuple `(xmin, xmax)`. Samples
+    outside of that range are discarded. All intervals are half-open,
+    except the last one, which also includes the right edge. This
+    follows the conventions of NumPy's [`histogram`](#numpy.histogram)
+    and gives identical results for the same bin edges, which are
+    computed in double precision.
+
+    Several data sets may be binned at once if `rows` is given, an
+    integer array of the same length as `x` that assigns each sample
+    to a data set. The `limits` are then arrays with one entry per
+    data set.
+
+    The samples are split into consecutive parts that are binned in
+    parallel threads if `workers` is more than one. A negative number
+    counts back from the number of CPU cores, so `-1` uses all of them.
+    If `None`, the default of SciPy's transforms applies, as set by
+    [`set_workers`](#scipy.fft.set_workers).
+    The partial counts are then added up, so the result is exactly the
+    same as when binning serially.
+
+    The counts are written to the integer array `out`, if given, which
+    then need not be allocated anew. When binning serially, the counts
+    of each block of samples are added to it directly, without
+    temporary arrays the size of the grid.
+
+    Returns the bin counts and the bin edges, with one row per data
+    set in the case of multiple data sets.
+    """
+    x = asarray(x)
+    (xmin, xmax) = limits
+    edges = linspace(xmin, xmax, bins+1, axis=-1)
+    m = 1 if rows is None else len(edges)
+
+    def count(part, counts=None):
+        direct = counts is not None
+        if not direct:
+            counts = zeros(m*bins, dtype=intp)
+        for chunk in part:
+            if rows is None:
+                (index, _) = indices(x[chunk], bins, xmin, xmax, edges)
+            else:
+                (index, r) = indices(x[chunk], bins, xmin, xmax, edges,
+                                     rows[chunk])
+                index += r*bins
+            tally(counts, index, direct)
+        return counts
+
+    counts = parallel(count, len(x), m*bins, workers, out)
+    if rows is not None:
+        counts = counts.reshape(m, bins)
+    return (counts, edges)
+
+
+def histogram2d(x, y, bins, limits, rows=None, workers=None, out=None):
+    """
+    Bins the sample coordinates `x` and `y` on a regular 2d grid.
+
+    `bins` is the number of intervals along each axis, or a tuple
+    `(nx, ny)` of those numbers. The grid extends over the `limits`,
+    a tuple `((xmin, xmax), (ymin, ymax))`. Samples outside of it are
+    discarded. As with `histogram` above, the results are identical
+    to those of NumPy's [`histogram2d`](#numpy.histogram2d), several
+    data sets may be binned at once if they are assigned to `rows`,
+    the work can be split among several `workers`, and the counts may
+    be written to an existing array `out`.
+
+    Returns the bin counts and the bin edges along either axis.
+    """
+    x = asarray(x)
+    y = asarray(y)
+    if isinstance(bins, tuple):
+        (nx, ny) = bins
+    else:
+        nx = ny = bins
+    ((xmin, xmax), (ymin, ymax)) = limits
+    xedges = linspace(xmin, xmax, nx+1, axis=-1)
+    yedges = linspace(ymin, ymax, ny+1, axis=-1)
+    m = 1 if rows is None else len(xedges)
+
+    def count(part, counts=None):
+        direct = counts is not None
+        if not direct:
+            counts = zeros(m*nx*ny, dtype=intp)
+        for chunk in part:
+            r = None if rows is None else asarray(rows[chunk])
+            xc = asarray(x[chunk], dtype='float64')
+            yc = asarray(y[chunk], dtype='float64')
+            inside = within(xc, xmin, xmax, r) & within(yc, ymin, ymax, r)
+            if not inside.all():
+                (xc, yc) = (xc[inside], yc[inside])
+                r = None if r is None else r[inside]
+            (ix, _) = indices(xc, nx, xmin, xmax, xedges, r, inside=True)
+            (iy, _) = indices(yc, ny, ymin, ymax, yedges, r, inside=True)
+            index = ix*ny + iy
+            if r is not None:
+                index += r*(nx*ny)
+            tally(counts, index, direct)
+        return counts
+
+    counts = parallel(count, len(x), m*nx*ny, workers, out)
+    if rows is None:
+        counts = counts.reshape(nx, ny)
+    else:
+        counts = counts.reshape(m, nx, ny)
+    return (counts, (xedges, yedges))
+
+
+def histogramdd(samples, bins, limits, workers=None):
+    """
+    Bins the `samples` on a regular grid in d dimensions.
+
+    `samples` is an N×d array holding the coordinates of N samples.
+    `bins` is a sequence of the number of intervals along each axis,
+    and `limits` a sequence of tuples `(min, max)`, one per axis.
+    Samples outside of the grid are discarded. The results are the
+    same as those of NumPy's [`histogramdd`](#numpy.histogramdd), and
+    the work can be split among several `workers`.
+
+    Returns the bin counts and the bin edges along each axis.
+    """
+    samples = asarray(samples)
+    bins = [int(b) for b in bins]
+    edges = [linspace(lower, upper, b+1)
+             for (b, (lower, upper)) in zip(bins, limits)]
+    size = 1
+    for b in bins:
+        size *= b
+
+    def count(part):
+        counts = zeros(size, dtype=intp)
+        for chunk in part:
+            values = asarray(samples[chunk], dtype='float64')
+            inside = True
+            for (m, (lower, upper)) in enumerate(limits):
+                inside = inside & within(values[:, m], lower, upper)
+            if not inside.all():
+                values = values[inside]
+            index = zeros(len(values), dtype=intp)
+            for (m, (lower, upper)) in enumerate(limits):
+                (i, _) = indices(values[:, m], bins[m], lower, upper,
+                                 edges[m], inside=True)
+                index = index*bins[m] + i
+            counts += bincount(index, minlength=size)
+        return counts
+
+    counts = parallel(count, len(samples), size, workers)
+    return (counts.reshape(bins), edges)
+
+
+########################################
+# Internal                             #
+########################################
+
+def threads(workers):
+    """Returns the number of threads to use for the given `workers`."""
+    if workers is None:
+        return get_workers()
+    if workers < 0:
+        workers += cpu_count() + 1
+    if workers < 1:
+        raise ValueError('Number of workers must be non-zero.')
+    return workers
+
+
+def parallel(count, N, size, workers=None, out=None):
+    """
+    Counts `N` samples with `count` and returns the total counts.
+
+    `count` takes a list of slices, each selecting a block of samples,
+    and returns the counts for those, an array of length `size`. If
+    also passed an array of that length, it adds the counts to it. The
+    blocks are divided evenly into consecutive parts, one per thread.
+    The total counts are written to `out`, if given.
+    """
+    length = max(block, size)
+    chunks = [slice(start, start+length) for start in range(0, N, length)]
+    parts  = min(threads(workers), len(chunks))
+    if out is not None:
+        if out.size != size or not out.flags.c_contiguous:
+            raise ValueError('Output array does not match the grid.')
+        out[...] = 0
+    if parts <= 1:
+        if out is None:
+            return count(chunks)
+        count(chunks, out.reshape(-1))
+        return out
+    split = [chunks[i*len(chunks)//parts : (i+1)*len(chunks)//parts]
+             for i in range(parts)]
+    with ThreadPoolExecutor(parts) as pool:
+        counts = sum(pool.map(count, split))
+    if out is None:
+        return counts
+    out.reshape(-1)[:] = counts
+    return out
+
+
+def tally(counts, index, direct=False):
+    """
+    Adds the samples at the bin `index` to the `counts`.
+
+    By default, the counts are added up with [`bincount`](#numpy.bincount),
+    which is fastest, but returns a temporary array the size of the
+    grid. If `direct` is true, they are incremented in place instead,
+    which is somewhat slower, but allocates nothing on the grid.
+    """
+    if direct:
+        add.at(counts, index, 1)
+    else:
+        counts += bincount(index, minlength=len(counts))
+
+
+def within(x, xmin, xmax, rows=None):
+    """Flags the samples `x` that lie inside the limits of their grid."""
+    if rows is None:
+        return (x >= xmin) & (x <= xmax)
+    return (x >= xmin[rows]) & (x <= xmax[rows])
+
+
+def indices(x, bins, xmin, xmax, edges, rows=None, inside=False):
+    """
+    Returns the bin indices of the samples `x` inside the limits.
+
+    Samples outside of the limits are dropped, unless the caller
+    asserts they are all `inside` already. Returns the indices along
+    with the `rows` of the samples that were kept.
+
+    The index is first estimated by scaling the distance from the lower
+    limit. Floating-point round-off may then have moved a sample into
+    a neighboring bin, but only if the scaled value is within a small
+    tolerance of an integer. Only those few samples are corrected by
+    comparing them with the actual `edges`.
+    """
+    x = asarray(x, dtype='float64')
+    if rows is not None:
+        rows = asarray(rows)
+    if not inside:
+        keep = within(x, xmin, xmax, rows)
+        if not keep.all():
+            x = x[keep]
+            rows = None if rows is None else rows[keep]
+    if rows is None:
+        (lower, upper, offset) = (xmin, xmax, 0)
+    else:
+        (lower, upper, offset) = (xmin[rows], xmax[rows], rows * (bins+1))
+    scaled = (x - lower) / (upper - lower) * bins
+    index  = scaled.astype(intp)
+    index[index == bins] -= 1
+
+    # The tolerance accounts for the round-off in the scaled values as
+    # well as in the edges, which grows with the limits' magnitude.
+    ratio = maximum(abs(xmin), abs(xmax)) / (xmax - xmin)
+    tolerance = 16 * finfo('float64').eps * bins * (1 + ratio.max())
+    fraction = scaled - index
+    near = ((fraction < tolerance) | (fraction > 1-tolerance)).nonzero()[0]
+    if len(near) > 0:
+        edges = edges.ravel()
+        i = index[near]
+        v = x[near]
+        o = offset if rows is None else offset[near]
+        i -= v < edges[o + i]
+        i += (v >= edges[o + i + 1]) & (i != bins-1)
+        index[near] = i
+    return (index, rows)
@@ -0,0 +1,160 @@
+﻿"""Kernel density estimation via diffusion for data larger than memory."""
+
+
+########################################
+# Dependencies                         #
+########################################
+from .binning import histogram, histogram2d
+from .kde1d import kde1d_binned, bounds as bounds1d, size
+from .kde2d import kde2d_binned, bounds as bounds2d, sizes
+from numpy import asarray, load, memmap, zeros, inf
+from pathlib import Path
+
+
+########################################
+# 1d                                   #
+########################################
+
+def kde1d_chunked(x, n=1024, limits=None, chunk=2**20, format=None,
+                  workers=None, rounding='power'):
+    """
+    Estimates the 1d density from observations too many to fit in memory.
+
+    `x` is either an array-like object that supports slicing, such as
+    a memory-mapped array returned by [`numpy.load`](#numpy.load) or
+    [`numpy.memmap`](#numpy.memmap), or the path to a file containing
+    the observations. A `.npy` file is memory-mapped as such, any other
+    file is read as raw binary data of the given `format`, a NumPy data
+    type such as `'float32'`.
+
+    The observations are then read in chunks of `chunk` values at a
+    time, so that peak memory use is bounded by the chunk size and the
+    grid size `n`, but does not depend on the total number of
+    observations. If the `limits` are given in full, all chunks are
+    binned in a single pass over the data. Otherwise, a first pass
+    determines the data range, and a second one bins the observations.
+
+    Arguments `n`, `limits`, `workers`, and `rounding` as well as the
+    returned `density`, `grid`, and `bandwidth` are the same as for
+    [`kde1d`](#kde1d), and so is the result. Raises `ValueError` if
+    the algorithm did not converge or the `format` of a raw binary file
+    was not specified.
+    """
+
+    # Open file, unless array-like data was passed in.
+    x = source(x, format)
+    N = len(x)
+
+    # Round up number of bins to next power of two or fast length.
+    n = size(n, rounding)
+
+    # Determine missing data limits in an extra pass.
+    (xmin, xmax) = bounds1d(limits)
+    if None in (xmin, xmax):
+        (lowest, highest) = extrema(x, chunk)
+        delta = highest - lowest
+        if xmin is None:
+            xmin = lowest - delta/10
+        if xmax is None:
+            xmax = highest + delta/10
+
+    # Bin samples on regular grid, one chunk at a time.
+    binned = zeros(n, dtype='int64')
+    for values in chunks(x, chunk):
+        binned += histogram(values, n, (xmin, xmax), workers=workers)[0]
+
+    # Estimate density from histogram.
+    return kde1d_binned(binned, (xmin, xmax), N, workers)
+
+
+########################################
+# 2d                                   #
+########################################
+
+def kde2d_chunked(x, y, n=256, limits=None, chunk=2**20, format=None,
+                  workers=None, rounding='power'):
+    """
+    Estimates the 2d density from observations too many to fit in memory.
+
+    `x` and `y` are array-like objects that support slicing, or paths
+    to files, holding the observations' coordinates. They are read in
+    chunks, as explained for [`kde1d_chunked`](#kde1d_chunked). The
+    other arguments, as well as the results, are the same as those of
+    [`kde2d`](#kde2d). Raises `ValueError` if the algorithm did not
+    converge or `x` and `y` are not the same length.
+    """
+
+    # Open files, unless array-like data was passed in.
+    x = source(x, format)
+    y = source(y, format)
+
+    # Make sure numbers of data points are consistent.
+    N = len(x)
+    if len(y) != N:
+        raise ValueError('x and y must have the same length.')
+
+    # Round up number of bins to next power of two or fast length.
+    (nx, ny) = sizes(n, rounding)
+
+    # Determine missing data limits in an extra pass.
+    ((xmin, xmax), (ymin, ymax)) = bounds2d(limits)
+    if None in (xmin, xmax):
+        (lowest, highest) = extrema(x, chunk)
+        delta = highest - lowest
+        if xmin is None:
+            xmin = lowest - delta/4
+        if xmax is None:
+            xmax = highest + delta/4
+    if None in (ymin, ymax):
+        (lowest, highest) = extrema(y, chunk)
+        delta = highest - lowest
+        if ymin is None:
+            ymin = lowest - delta/4
+        if ymax is None:
+            ymax = highest + delta/4
+
+    # Bin samples on regular grid, one chunk at a time.
+    binned = zeros((nx, ny), dtype='int64')
+    limits = ((xmin, xmax), (ymin, ymax))
+    for (xvalues, yvalues) in zip(chunks(x, chunk), chunks(y, chunk)):
+        binned += histogram2d(xvalues, yvalues, (nx, ny), limits,
+                              workers=workers)[0]
+
+    # Estimate density from histogram.
+    return kde2d_binned(binned, limits, N, workers)
+
+
+########################################
+# Internal                             #
+########################################
+
+def source(x, format=None):
+    """
+    Returns the array-like data source `x`, memory-mapping it if it is
+    a file path: as a `.npy` file if it has that suffix, else as raw
+    binary data of type `format`.
+    """
+    if not isinstance(x, (str, Path)):
+        return x
+    path = Path(x)
+    if path.suffix == '.npy':
+        return load(path, mmap_mode='r')
+    if format is None:
+        raise ValueError('Data type of raw binary files must be specified.')
+    return memmap(path, dtype=format, mode='r')
+
+
+def chunks(x, size):
+    """Yields the values of `x` as arrays of at most `size` elements."""
+    for start in range(0, len(x), size):
+        yield asarray(x[start:start+size])
+
+
+def extrema(x, size):
+    """Returns the minimum and maximum of `x`, read in chunks of `size`."""
+    lowest  = +inf
+    highest = -inf
+    for values in chunks(x, size):
+        lowest  = min(lowest,  values.min())
+        highest = max(highest, values.max())
+    return (lowest, highest)
@@ -0,0 +1,130 @@
+﻿"""Constants of the estimation that only depend on the grid size."""
+
+
+########################################
+# Dependencies                         #
+########################################
+from numpy import arange, array
+from numpy import prod as product
+from functools import lru_cache, wraps
+
+
+########################################
+# Settings                             #
+########################################
+
+capacity = 64
+"""Number of grid sizes, or dimensions, for which constants are cached."""
+
+limit = 2**12
+"""
+Largest grid size for which constants are cached. Beyond it, they are
+computed anew each time, so the caches take up no more than a few
+megabytes, whatever the grid sizes. The constants take time
+proportional to the grid size, while the transformations take longer
+anyway.
+"""
+
+
+########################################
+# Constants                            #
+########################################
+
+doubles = array([product(arange(1, 2*l, 2)) for l in range(8)],
+                dtype='float')
+"""
+Double factorials (2l-1)!! of the orders l up to 7, which enter the
+diffusion times at each step of the recursion for the functionals.
+"""
+doubles.flags.writeable = False
+
+
+########################################
+# Cache                                #
+########################################
+
+# The caches below are safe to use from several threads at once: The
+# bookkeeping of `lru_cache` is guarded by a lock, and the arrays that
+# are handed out are read-only, so one call cannot alter them for
+# another. At worst, two threads missing the cache at the same time
+# both compute the same constants.
+
+def cached(function):
+    """
+    Caches the constants returned by `function` for sizes up to `limit`.
+
+    The wrapper exposes `cache_info` and `cache_clear` of the underlying
+    [`lru_cache`](#functools.lru_cache).
+    """
+    cache = lru_cache(maxsize=capacity)(function)
+
+    @wraps(function)
+    def wrapper(n):
+        if n > limit:
+            return function(n)
+        return cache(n)
+
+    wrapper.cache_info  = cache.cache_info
+    wrapper.cache_clear = cache.cache_clear
+    return wrapper
+
+
+@cached
+def indices(n):
+    """Returns the indices k of `n` cosine components, as floats."""
+    k = arange(n, dtype='float')       # "float" avoids integer overflow.
+    k.flags.writeable = False
+    return k
+
+
+@cached
+def squares(n):
+    """Returns the squared indices k² of `n` cosine components."""
+    k2 = indices(n)**2
+    k2.flags.writeable = False
+    return k2
+
+
+@cached
+def powers(n):
+    """
+    Returns the powers of the squared indices of `n` cosine components.
+
+    Row l of the returned 8×n array holds (k²)ˡ, from l = 0 up to the
+    order 7 at which the recursion begins in 1d. Row 1 thus holds the
+    squared indices themselves.
+    """
+    table = squares(n) ** arange(8)[:, None]
+    table.flags.writeable = False
+    return table
+
+
+@cached
+def factors(d):
+    """
+    Returns the factors C of each order s in `d` dimensions.
+
+    They enter the diffusion times at each step of the recursion for
+    the functionals, as (1 + 2^-(s + d/2)) / 3, with s up to 7.
+    """
+    table = (1 + 1/2**(arange(8) + d/2)) / 3
+    table.flags.writeable = False
+    return table
+
+
+def statistics():
+    """
+    Returns the hits and misses of the caches, by name.
+
+    Each entry is the named tuple reported by `cache_info` of
+    [`lru_cache`](#functools.lru_cache), with fields `hits`, `misses`,
+    `maxsize`, and `currsize`.
+    """
+    return {cache.__name__: cache.cache_info()
+            for cache in (indices, squares, powers, factors)}
+
+
+def clear():
+    """Empties the caches and resets their statistics."""
+    for cache in (indices, squares, powers, factors):
+        cache.cache_clear()
@@ -0,0 +1,502 @@
+﻿"""Fitted density estimates that can be evaluated at arbitrary points."""
+
+
+########################################
+# Dependencies                         #
+########################################
+from .kde1d import kde1d, kde1d_binned
+from .kde1d import bounds as bounds1d, extent as extent1d
+from .kde2d import kde2d, kde2d_binned
+from .kde2d import bounds as bounds2d, extent as extent2d
+from numpy import asarray, empty, zeros, linspace, arange, stack
+from numpy import floor, clip, where, moveaxis, broadcast_arrays, intp
+from numpy import cumsum, diff, concatenate, append, maximum, searchsorted
+from numpy import minimum
+from numpy import prod as product
+from numpy import cos, sin, pi as π
+from numpy.random import default_rng
+from scipy.fft import dct, dctn, dst
+
+
+########################################
+# Settings                             #
+########################################
+
+block = 2**16
+"""Number of samples drawn at a time, keeping temporary arrays small."""
+
+
+########################################
+# 1d                                   #
+########################################
+
+class KDE1d:
+    """
+    Density estimate in 1d that can be evaluated at arbitrary points.
+
+    Holds the `density` on the grid within the data `limits`, given as
+    a tuple (`xmin`, `xmax`) or a single number denoting the upper
+    bound of a range centered at zero, along with the `bandwidth`, if
+    known. Rather than created directly, the estimate is usually fitted
+    to observations with [`fit`](#KDE1d.fit), or to binned observations
+    with [`from_binned`](#KDE1d.from_binned).
+
+    Calling the object with an array of `points` returns the density
+    at those points. By default, it is interpolated linearly between
+    grid points, using tables precomputed for each grid cell, so each
+    point costs the same small, constant effort. With `exact=True`, the
+    cosine series underlying the estimate is summed up instead, which
+    costs time proportional to the grid size per point. Both agree at
+    the grid points. The density is zero outside of the limits.
+
+    Random samples may be drawn from the estimate with
+    [`sample`](#KDE1d.sample). The cumulative distribution function,
+    its inverse, and the probability of intervals are available via
+    [`cdf`](#KDE1d.cdf), [`quantile`](#KDE1d.quantile), and
+    [`probability`](#KDE1d.probability). They are normalized to the
+    probability `mass` within the limits.
+    """
+
+    def __init__(self, density, limits, bandwidth=None):
+        self.density   = asarray(density)
+        self.limits    = bounds1d(limits)
+        self.bandwidth = bandwidth
+        (xmin, xmax) = self.limits
+        n = len(self.density)
+        self.grid = linspace(xmin, xmax, n+1)[:-1]
+
+        # Tabulate each cell's value and slope in units of grid spacings.
+        self.slope  = self.density[1:] - self.density[:-1]
+        self.offset = self.density[:-1] - self.slope * arange(n-1)
+
+        # Recover the smoothed cosine coefficients from the density.
+        self.coefficients = dct(self.density) * (xmax - xmin)/n
+        self.coefficients[0] /= 2
+
+        # Integrate cosine series at grid points and interpolate in between.
+        (self.probabilities, self.spline, self.mass) = integral(
+            self.coefficients, self.density, xmax - xmin)
+
+        # Tabulate the alias table of the grid cells.
+        (self.share, self.alias) = table(diff(self.probabilities))
+
+    @classmethod
+    def fit(cls, x, n=1024, limits=None, workers=None, rounding='power'):
+        """
+        Estimates the density from the observations `x`.
+
+        Takes the same arguments as [`kde1d`](#kde1d) and returns the
+        fitted estimate.
+        """
+        x = asarray(x)
+        limits = extent1d(x, limits)
+        (density, _, bandwidth) = kde1d(x, n, limits, workers=workers,
+                                        rounding=rounding)
+        return cls(density, limits, bandwidth)
+
+    @classmethod
+    def from_binned(cls, binned, limits, N=None, workers=None):
+        """
+        Estimates the density from the `binned` observations.
+
+        Takes the same arguments as [`kde1d_binned`](#kde1d_binned) and
+        returns the fitted estimate.
+        """
+        (density, _, bandwidth) = kde1d_binned(binned, limits, N, workers)
+        return cls(density, limits, bandwidth)
+
+    def __call__(self, points, exact=False):
+        """Returns the density at the given `points`."""
+        points = asarray(points, dtype='float')
+        (xmin, xmax) = self.limits
+        n = len(self.density)
+        inside = (points >= xmin) & (points <= xmax)
+        u = where(inside, (points - xmin) / (xmax - xmin), 0)
+        if exact:
+            θ = π * (u + 1/(2*n))
+            values = series(self.coefficients, θ) / (xmax - xmin)
+        else:
+            u = u * n
+            i = clip(floor(u), 0, n-2).astype(intp)
+            values = self.offset[i] + self.slope[i] * u
+        return where(inside, values, 0)
+
+    def sample(self, size=None, rng=None):
+        """
+        Draws random samples from the estimated density.
+
+        Returns an array of the given `size`, which may be an integer
+        or a tuple denoting the shape, or a single number if omitted.
+        `rng` is a NumPy [`Generator`](#numpy.random.Generator) or a
+        seed to create one from.
+
+        Each sample is assigned to a grid cell, between two grid points,
+        with the probability that [`cdf`](#KDE1d.cdf) gives for it, and
+        placed uniformly within that cell. One random number does both:
+        The cell is looked up in an alias table precomputed on creation,
+        which takes the same effort for any density, and what is left of
+        the random number serves as the offset within the cell.
+        """
+        rng = default_rng(rng)
+        (xmin, xmax) = self.limits
+        n = len(self.density)
+        count = 1 if size is None else int(product(size))
+        u = rng.random(count)
+        samples = empty(count)
+        for start in range(0, count, block):
+            part = slice(start, start+block)
+            (cells, offsets) = draw(self.share, self.alias, u[part])
+            samples[part] = cells + offsets
+        samples *= (xmax - xmin)/n
+        samples += xmin
+        if size is None:
+            return samples[0]
+        return samples.reshape(size)
+
+    def cdf(self, points, exact=False):
+        """
+        Returns the cumulative distribution function at the `points`.
+
+        The cosine series is integrated term by term, which gives a sine
+        series. It is summed up at the grid points when the estimate is
+        created. In between, the function is interpolated by cubic
+        polynomials that also match the density at the grid points. With
+        `exact=True`, the sine series is summed up for each point.
+        """
+        points = asarray(points, dtype='float')
+        (xmin, xmax) = self.limits
+        n = len(self.density)
+        u = clip((points - xmin) / (xmax - xmin), 0, 1)
+        if exact:
+            w = concatenate(([0], u.ravel())) + 1/(2*n)
+            a = self.coefficients[1:] / (π * arange(1, n))
+            F = self.coefficients[0]*w + sines(a, π*w)
+            return ((F[1:] - F[0]) / self.mass).reshape(u.shape)
+        u = u * n
+        i = clip(floor(u), 0, n-1).astype(intp)
+        t = u - i
+        (c0, c1, c2, c3) = moveaxis(self.spline[i], -1, 0)
+        return c0 + t*(c1 + t*(c2 + t*c3))
+
+    def quantile(self, q):
+        """
+        Returns the quantiles for the probabilities `q`.
+
+        This is the inverse of [`cdf`](#KDE1d.cdf). The grid cell is
+        looked up by binary search in the table of cumulative
+        probabilities, then the cubic polynomial inside the cell is
+        inverted by Newton's method.
+        """
+        q = asarray(q, dtype='float')
+        (xmin, xmax) = self.limits
+        n = len(self.density)
+        i = searchsorted(self.probabilities, q, side='right') - 1
+        i = clip(i, 0, n-1)
+        (c0, c1, c2, c3) = moveaxis(self.spline[i], -1, 0)
+        width = self.probabilities[i+1] - self.probabilities[i]
+        t = where(width > 0, (q - c0) / where(width > 0, width, 1), 0)
+        t = clip(t, 0, 1)
+        for _ in range(20):
+            slope = c1 + t*(2*c2 + t*3*c3)
+            value = c0 + t*(c1 + t*(c2 + t*c3)) - q
+            step = where(slope > 0, value / where(slope > 0, slope, 1), 0)
+            t = clip(t - step, 0, 1)
+            if (abs(step) < 1e-12).all():
+                break
+        return xmin + (i + t) * (xmax - xmin)/n
+
+    def probability(self, a, b, exact=False):
+        """Returns the probability of the intervals from `a` to `b`."""
+        return self.cdf(b, exact) - self.cdf(a, exact)
+
+
+########################################
+# 2d                                   #
+########################################
+
+class KDE2d:
+    """
+    Density estimate in 2d that can be evaluated at arbitrary points.
+
+    The 2d counterpart of [`KDE1d`](#KDE1d). The `limits` are given as
+    a tuple `((xmin, xmax), (ymin, ymax))`, or in any of the other forms
+    accepted by [`kde2d`](#kde2d), as long as no bound is left open.
+
+    Calling the object with the coordinates `x` and `y` of points
+    returns the density at those points. By default, it is interpolated
+    bilinearly, using precomputed tables holding four coefficients per
+    grid cell. With `exact=True`, the cosine series is summed up, which
+    is accurate, but costs time proportional to the number of grid
+    points per point. Random samples are drawn with
+    [`sample`](#KDE2d.sample), and the marginal distributions are
+    returned by [`marginal`](#KDE2d.marginal).
+    """
+
+    def __init__(self, density, limits, bandwidth=None):
+        self.density   = asarray(density)
+        self.limits    = bounds2d(limits)
+        self.bandwidth = bandwidth
+        ((xmin, xmax), (ymin, ymax)) = self.limits
+        (nx, ny) = self.density.shape
+        self.grid = (linspace(xmin, xmax, nx+1)[:-1],
+                     linspace(ymin, ymax, ny+1)[:-1])
+
+        # Tabulate bilinear coefficients per cell, relative to its corner.
+        d = self.density
+        self.table = stack([d[:-1, :-1],
+                            d[1:, :-1] - d[:-1, :-1],
+                            d[:-1, 1:] - d[:-1, :-1],
+                            d[1:, 1:] - d[1:, :-1] - d[:-1, 1:] + d[:-1, :-1]],
+                           axis=-1)
+
+        # Recover the smoothed cosine coefficients from the density.
+        self.coefficients = (dctn(self.density)
+                             * (xmax - xmin)/nx * (ymax - ymin)/ny)
+        self.coefficients[0, :] /= 2
+        self.coefficients[:, 0] /= 2
+
+        # Integrate cosine series over the grid cells, and tabulate the
+        # alias table of the cells, row by row.
+        F = antiderivative(antiderivative(self.coefficients, 0), 1)
+        masses = diff(diff(F, axis=0), axis=1)
+        (self.share, self.alias) = table(masses.ravel())
+
+    @classmethod
+    def fit(cls, x, y, n=256, limits=None, workers=None,
+            rounding='power'):
+        """
+        Estimates the density from the observations' coordinates `x` and
+        `y`. Takes the same arguments as [`kde2d`](#kde2d) and returns
+        the fitted estimate.
+        """
+        x = asarray(x)
+        y = asarray(y)
+        limits = extent2d(x, y, limits)
+        (density, _, bandwidth) = kde2d(x, y, n, limits, workers=workers,
+                                        rounding=rounding)
+        return cls(density, limits, bandwidth)
+
+    @classmethod
+    def from_binned(cls, binned, limits, N=None, workers=None):
+        """
+        Estimates the density from the `binned` observations. Takes the
+        same arguments as [`kde2d_binned`](#kde2d_binned) and returns
+        the fitted estimate.
+        """
+        (density, _, bandwidth) = kde2d_binned(binned, limits, N, workers)
+        return cls(density, limits, bandwidth)
+
+    def __call__(self, x, y, exact=False, chunk=2**16):
+        """
+        Returns the density at the points with coordinates `x` and `y`.
+        In `exact` mode, points are evaluated in chunks of `chunk`.
+        """
+        (x, y) = broadcast_arrays(asarray(x, dtype='float'),
+                                  asarray(y, dtype='float'))
+        ((xmin, xmax), (ymin, ymax)) = self.limits
+        (nx, ny) = self.density.shape
+        inside = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+        u = where(inside, (x - xmin) / (xmax - xmin), 0)
+        v = where(inside, (y - ymin) / (ymax - ymin), 0)
+        if exact:
+            (u, v) = (u.ravel(), v.ravel())
+            values = empty(len(u))
+            kx = arange(nx)
+            ky = arange(ny)
+            for start in range(0, len(u), chunk):
+                part = slice(start, start+chunk)
+                cx = cos(π * (u[part, None] + 1/(2*nx)) * kx)
+                cy = cos(π * (v[part, None] + 1/(2*ny)) * ky)
+                values[part] = ((cx @ self.coefficients) * cy).sum(axis=-1)
+            values = values.reshape(x.shape) / (xmax - xmin) / (ymax - ymin)
+        else:
+            (u, v) = (u * nx, v * ny)
+            i = clip(floor(u), 0, nx-2).astype(intp)
+            j = clip(floor(v), 0, ny-2).astype(intp)
+            (s, t) = (u - i, v - j)
+            (a, b, c, d) = moveaxis(self.table[i, j], -1, 0)
+            values = a + b*s + c*t + d*s*t
+        return where(inside, values, 0)
+
+    def sample(self, size=None, rng=None):
+        """
+        Draws random samples from the estimated density.
+
+        Returns the coordinates `x` and `y` of the samples, each an
+        array of the given `size`, or single numbers if omitted. `rng`
+        is a NumPy [`Generator`](#numpy.random.Generator) or a seed.
+        Grid cells are selected with their probability, the integral of
+        the cosine series over the cell, as explained for
+        [`KDE1d.sample`](#KDE1d.sample), which also places the samples
+        within the cells along x. A second random number does so along y.
+        """
+        rng = default_rng(rng)
+        ((xmin, xmax), (ymin, ymax)) = self.limits
+        (nx, ny) = self.density.shape
+        count = 1 if size is None else int(product(size))
+        (u, v) = (rng.random(count), rng.random(count))
+        (x, y) = (empty(count), empty(count))
+        for start in range(0, count, block):
+            part = slice(start, start+block)
+            (cells, offsets) = draw(self.share, self.alias, u[part])
+            (i, j) = divmod(cells, ny)
+            x[part] = i + offsets
+            y[part] = j + v[part]
+        x *= (xmax - xmin)/nx
+        x += xmin
+        y *= (ymax - ymin)/ny
+        y += ymin
+        if size is None:
+            return (x[0], y[0])
+        return (x.reshape(size), y.reshape(size))
+
+    def marginal(self, axis=0):
+        """
+        Returns the marginal density along the given `axis`.
+
+        The density is integrated over the other axis, i.e. over `y` for
+        `axis=0` and over `x` for `axis=1`, and returned as a
+        [`KDE1d`](#KDE1d) object. Summing the grid values is exact here,
+        as all but the constant cosine terms sum up to zero.
+        """
+        ((xmin, xmax), (ymin, ymax)) = self.limits
+        (nx, ny) = self.density.shape
+        if axis == 0:
+            density = self.density.sum(axis=1) * (ymax - ymin)/ny
+        else:
+            density = self.density.sum(axis=0) * (xmax - xmin)/nx
+        bandwidth = None if self.bandwidth is None else self.bandwidth[axis]
+        return KDE1d(density, self.limits[axis], bandwidth)
+
+
+########################################
+# Internal                             #
+########################################
+
+def series(coefficients, θ):
+    """
+    Sums up the cosine series with the given `coefficients` at the
+    angles `θ`, using Clenshaw's recurrence.
+    """
+    c = 2 * cos(θ)
+    b1 = zeros(θ.shape)
+    b2 = zeros(θ.shape)
+    for ck in coefficients[:0:-1]:
+        (b1, b2) = (ck + c*b1 - b2, b1)
+    return coefficients[0] + b1*c/2 - b2
+
+
+def sines(coefficients, θ):
+    """
+    Sums up the sine series with the given `coefficients`, starting at
+    the first harmonic, at the angles `θ`, using Clenshaw's recurrence.
+    """
+    c = 2 * cos(θ)
+    b1 = zeros(θ.shape)
+    b2 = zeros(θ.shape)
+    for ck in coefficients[::-1]:
+        (b1, b2) = (ck + c*b1 - b2, b1)
+    return b1 * sin(θ)
+
+
+def antiderivative(coefficients, axis=-1):
+    """
+    Returns the integral of the cosine series with the given
+    `coefficients` along the `axis`, at the grid points and the upper
+    limit.
+
+    The integral up to each grid point is a sine series, which is a
+    discrete sine transform of type 3 for all of them at once. It is
+    extended to the upper limit by the series' mirror symmetry there.
+    Along other axes, if any, the coefficients are carried over as is.
+    """
+    c = moveaxis(coefficients, axis, -1)
+    n = c.shape[-1]
+    a = zeros(c.shape)
+    a[..., :-1] = c[..., 1:] / (π * arange(1, n))
+    w = (arange(n) + 1/2) / n
+    F = c[..., :1]*w + dst(a, type=3)/2
+    F = concatenate((F, 2*c[..., :1] - F[..., -1:]), axis=-1)
+    return moveaxis(F, -1, axis)
+
+
+def integral(coefficients, density, width):
+    """
+    Returns the cumulative distribution at the grid points, the cubic
+    interpolation polynomials for each grid cell, and the total mass.
+
+    The cosine series has the `coefficients`, the `density` is its value
+    at the grid points, and `width` is the grid's range. Each cell's
+    polynomial matches the integral of the series and the density at
+    both ends, with coefficients in ascending order of powers of the
+    fractional position within the cell.
+    """
+    n = len(coefficients)
+    F = antiderivative(coefficients)
+    mass = F[-1] - F[0]
+    P = (F - F[0]) / mass
+    d = append(density, density[-1]) * width/n / mass
+    ΔP = diff(P)
+    spline = stack([P[:-1], d[:-1],
+                    3*ΔP - 2*d[:-1] - d[1:],
+                    -2*ΔP + d[:-1] + d[1:]], axis=-1)
+    return (P, spline, mass)
+
+
+def table(masses):
+    """
+    Returns the alias table of the grid cells, given their probability
+    `masses`, which need not be normalized.
+
+    Negative values, a possible artifact of the cosine transformation,
+    are taken as zero. Following Walker's alias method, each of the n
+    cells is assigned an equal share 1/n of the probability, of which
+    the fraction `share` falls to the cell itself and the rest to the
+    cell named by `alias`. Drawing a cell then takes one table look-up,
+    whatever the density.
+
+    Cells with less than average probability, the light ones, are
+    served in turn by the heavy ones. A heavy cell whose excess is used
+    up becomes light itself and is served by the next heavy cell. So
+    the cumulative sums of the deficits and the excesses tell which
+    cell serves which, without a loop over the cells.
+    """
+    n = len(masses)
+    p = maximum(masses, 0)
+    p = p * (n / p.sum())
+    heavy = (p >= 1)
+    heavy[p.argmax()] = True
+    (light, heavy) = ((~heavy).nonzero()[0], heavy.nonzero()[0])
+    ends   = concatenate(([0], cumsum(1 - p[light])))
+    excess = cumsum(p[heavy] - 1)
+    share  = p.copy()
+    alias  = arange(n)
+    served = searchsorted(excess, ends[:-1], side='right')
+    alias[light] = heavy[minimum(served, len(heavy)-1)]
+    overrun = ends[searchsorted(ends[:-1], excess, side='left')] - excess
+    share[heavy] = 1 - maximum(overrun, 0)
+    alias[heavy[:-1]] = heavy[1:]
+    share[heavy[-1]] = 1
+    return (share, alias)
+
+
+def draw(share, alias, u):
+    """
+    Returns the grid cells, and the offsets within them, of the samples
+    for the uniform random numbers `u`, given the alias table of the
+    cells.
+
+    The integer part of `u` times the number of cells selects an entry
+    of the table, the fractional part decides between the cell and its
+    alias. How far that fraction falls into the cell's part of the
+    entry then serves as the offset within the cell, from 0 to 1.
+    """
+    n = len(share)
+    v = u * n
+    k = minimum(v.astype(intp), n-1)
+    f = v - k
+    q = share[k]
+    own = (f < q)
+    cells = where(own, k, alias[k])
+    offsets = where(own, f, f - q) / where(own, q, 1 - q)
+    return (cells, offsets)
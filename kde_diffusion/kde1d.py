@@ -4,20 +4,23 @@
 ########################################
 # Dependencies                         #
 ########################################
-from numpy import array, arange
-from numpy import exp, sqrt, pi as π
+from .binning import histogram
+from .solver import solve
+from .workspace import check
+from .constants import squares, doubles, factors
+from numpy import array, asarray, empty, linspace, copyto
+from numpy import exp, sqrt, square, multiply, pi as π
 from numpy import ceil, log2
-from numpy import prod as product
-from numpy import histogram
-from scipy.fft import dct, idct
-from scipy.optimize import brentq
+from scipy.fft import dct, idct, next_fast_len
 
 
 ########################################
 # Main                                 #
 ########################################
 
-def kde1d(x, n=1024, limits=None):
+def kde1d(x, n=1024, limits=None, workers=None, rounding='power',
+          dtype='float64', out=None, workspace=None, bandwidth=None,
+          bandwidth_only=False, guess=None, full_output=False):
     """
     Estimates the 1d density from discrete observations.
 
@@ -25,7 +28,11 @@ def kde1d(x, n=1024, limits=None):
     observations of a random variable. They are binned on a grid of
     `n` points within the data `limits`, if specified, or within
     the limits given by the values' range. `n` will be coerced to the
-    next highest power of two if it isn't one to begin with.
+    next highest power of two if it isn't one to begin with. With
+    `rounding='fast'`, it is rounded up to the next size for which the
+    cosine transformations are fast instead, a number with no prime
+    factors other than 2, 3, and 5, such as 300. That is often much
+    closer to the size requested, and saves memory and run time.
 
     The limits may be given as a tuple (`xmin`, `xmax`) or a single
     number denoting the upper bound of a range centered at zero.
@@ -37,80 +44,346 @@ def kde1d(x, n=1024, limits=None):
     binned data over the grid using a Gaussian kernel with a standard
     deviation corresponding to that bandwidth.
 
+    The binning as well as the cosine transformations may be split
+    among several threads, given by `workers`. A negative number counts
+    back from the number of CPU cores, so `-1` uses all of them. If not
+    given, the default set by SciPy's [`set_workers`](#scipy.fft.set_workers)
+    context manager applies, which is one thread unless changed.
+
+    The transformations and the smoothing run in double precision by
+    default. With `dtype='float32'`, they run in single precision
+    instead, which halves the memory that the arrays on the grid take
+    up, and speeds up the transformations. The bandwidth optimization
+    still runs in double precision, so the bandwidth is nearly the same,
+    but the density is only accurate to about six significant digits,
+    relative to its maximum.
+
+    The density is written to the array `out`, if given, which must
+    have the size of the grid and a floating-point type. Repeated calls
+    on grids of the same size may also pass the same
+    [`Workspace`](#Workspace), set up for that size and `dtype`, which
+    then holds the bin counts and all intermediate results. Together,
+    they avoid allocating any arrays on the grid, except for the grid
+    coordinates that are returned.
+
+    If the `bandwidth` is already known, for instance from earlier data
+    of the same kind, it may be passed in. The optimization is then
+    skipped altogether, and the data is smoothed with a kernel of that
+    bandwidth right away. Conversely, if `bandwidth_only` is `True`, the
+    optimal bandwidth is determined, but the data is not smoothed, and
+    only the bandwidth returned.
+
     Returns the estimated `density` and the `grid` upon which it was
     computed, as well as the optimal `bandwidth` value the algorithm
     determined. Raises `ValueError` if the algorithm did not converge.
+
+    The optimal bandwidth follows from the root of a function of the
+    diffusion time. If a `guess` of that root is given, such as the
+    one found for earlier data of the same kind, the search starts
+    there, and usually takes only a few steps if the guess was close.
+    Otherwise, the root is searched for within fixed bounds.
+
+    If `full_output` is `True`, a fourth item is returned: the results
+    of the root search for the optimal diffusion time, with the same
+    attributes as those reported by SciPy's [`brentq`](#scipy.optimize.brentq).
+    Its `root` may serve as the `guess` next time, and `iterations` and
+    `function_calls` tell how much work the search took. The results
+    are `None` if the bandwidth was given. With `bandwidth_only`,
+    the results of the root search are returned along with the
+    bandwidth.
     """
 
     # Convert to array in case a list is passed in.
     x = array(x)
 
-    # Round up number of bins to next power of two.
-    n = int(2**ceil(log2(n)))
+    # Round up number of bins to next power of two or fast length.
+    n = size(n, rounding)
+    check(workspace, (n,), dtype)
 
     # Determine missing data limits.
+    (xmin, xmax) = extent(x, limits)
+
+    # Determine data range, required for scaling.
+    Δx = xmax - xmin
+
+    # Determine number of data points.
+    N = len(x)
+
+    # Bin samples on regular grid, in the workspace if given.
+    counts = None if workspace is None else workspace.counts
+    (binned, edges) = histogram(x, n, (xmin, xmax), workers=workers,
+                                out=counts)
+    grid = edges[:-1]
+
+    # Estimate density from histogram.
+    (density, bandwidth, info) = estimate(binned, N, Δx, workers,
+                                          dtype=dtype, out=out,
+                                          workspace=workspace,
+                                          bandwidth=bandwidth,
+                                          bandwidth_only=bandwidth_only,
+                                          guess=guess)
+
+    # Return results.
+    if bandwidth_only:
+        return (bandwidth, info) if full_output else bandwidth
+    if full_output:
+        return (density, grid, bandwidth, info)
+    return (density, grid, bandwidth)
+
+
+def kde1d_binned(binned, limits, N=None, workers=None, dtype='float64',
+                 out=None, workspace=None, bandwidth=None,
+                 bandwidth_only=False, guess=None, full_output=False):
+    """
+    Estimates the 1d density from observations already binned.
+
+    `binned` is a list/array of the counts of observations on a
+    regular grid of bins within the data `limits`, which may be given
+    in any of the forms accepted by [`kde1d`](#kde1d), but may not
+    contain `None`. The grid size is not constrained to powers of two.
+    `N` is the total number of observations, including any outside the
+    limits. It defaults to the sum of all counts.
+
+    Skipping the binning step, the run time does not depend on the
+    number of observations, but only on the grid size. Given the
+    counts that `kde1d` would determine itself, the results are the
+    same: the estimated `density`, the `grid`, and the `bandwidth`.
+    `workers`, `dtype`, `out`, `workspace`, `bandwidth`,
+    `bandwidth_only`, `guess`, and `full_output` have the same meaning
+    as for `kde1d`, and so has the fourth item returned with the latter.
+    Raises `ValueError` if the algorithm did not converge or the limits
+    are incomplete.
+    """
+
+    # Convert to array in case a list is passed in.
+    binned = asarray(binned)
+    check(workspace, binned.shape, dtype)
+
+    # Unpack data limits, which cannot be inferred.
+    (xmin, xmax) = bounds(limits)
+    if None in (xmin, xmax):
+        raise ValueError('Limits of binned data must be given.')
+    Δx = xmax - xmin
+
+    # Count data points unless specified.
+    if N is None:
+        N = binned.sum()
+
+    # Construct grid from bin edges.
+    n = len(binned)
+    grid = linspace(xmin, xmax, n+1)[:-1]
+
+    # Estimate density from histogram.
+    (density, bandwidth, info) = estimate(binned, N, Δx, workers, dtype=dtype,
+                                          out=out, workspace=workspace,
+                                          bandwidth=bandwidth,
+                                          bandwidth_only=bandwidth_only,
+                                          guess=guess)
+
+    # Return results.
+    if bandwidth_only:
+        return (bandwidth, info) if full_output else bandwidth
+    if full_output:
+        return (density, grid, bandwidth, info)
+    return (density, grid, bandwidth)
+
+
+########################################
+# Internal                             #
+########################################
+
+def bounds(limits):
+    """
+    Returns the lower and upper bound specified by the data `limits`.
+
+    Accepts the same forms of `limits` as `kde1d`. Either bound may be
+    returned as `None`, meaning it is to be inferred from the data.
+    """
     if limits is None:
-        xmin = xmax = None
-    elif isinstance(limits, tuple):
-        (xmin, xmax) = limits
-    else:
-        xmin = -limits
-        xmax = +limits
+        return (None, None)
+    if isinstance(limits, tuple):
+        return limits
+    return (-limits, +limits)
+
+
+def size(n, rounding='power'):
+    """
+    Returns the number of grid points for the requested number `n`.
+
+    It is rounded up to the next power of two if `rounding` is `'power'`,
+    or to the next fast length of SciPy's transforms, as determined by
+    [`next_fast_len`](#scipy.fft.next_fast_len), if it is `'fast'`.
+    """
+    if rounding == 'power':
+        return int(2**ceil(log2(n)))
+    if rounding == 'fast':
+        return next_fast_len(int(ceil(n)), real=True)
+    raise ValueError(f'Unknown rounding "{rounding}".')
+
+
+def extent(x, limits):
+    """
+    Returns the data limits `(xmin, xmax)` for the observations `x`.
+
+    Bounds that `limits` leaves open are inferred from the data range,
+    extended by a tenth of its width on either side.
+    """
+    (xmin, xmax) = bounds(limits)
     if None in (xmin, xmax):
         delta = x.max() - x.min()
         if xmin is None:
             xmin = x.min() - delta/10
         if xmax is None:
             xmax = x.max() + delta/10
+    return (xmin, xmax)
 
-    # Determine data range, required for scaling.
-    Δx = xmax - xmin
 
-    # Determine number of data points.
-    N = len(x)
+def estimate(binned, N, Δx, workers=None, guess=None, dtype='float64',
+             out=None, workspace=None, bandwidth=None, bandwidth_only=False):
+    """
+    Estimates the density from the `binned` observations.
 
-    # Bin samples on regular grid.
-    (binned, edges) = histogram(x, bins=n, range=(xmin, xmax))
-    grid = edges[:-1]
+    `binned` holds the counts on the regular grid, `N` is the total
+    number of observations, and `Δx` the width of the grid's range.
+    The transformations run on the given number of `workers`. If a
+    `guess` of the optimal diffusion time is given, such as that for
+    similar data, the root search starts from there. The transformations
+    and the smoothing are done in the given floating-point `dtype`, the
+    root search always in double precision.
+    Returns the `density` on the grid, the optimal `bandwidth`, and
+    the results of the root search for the optimal diffusion time.
+
+    The density is written to `out`, if given. Arrays on the grid are
+    taken from the `workspace`, if given, instead of being allocated.
+
+    If the `bandwidth` is given, the root search is skipped, and its
+    results returned as `None`. With `bandwidth_only`, the density is
+    not computed, but returned as `None`.
+    """
 
-    # Compute 2d discrete cosine transform, then adjust first component.
-    transformed = dct(binned/N)
+    # Make sure a given bandwidth can be used.
+    if bandwidth is not None:
+        if bandwidth_only:
+            raise ValueError('Bandwidth cannot be given if it is to be found.')
+        if not bandwidth > 0:
+            raise ValueError('Bandwidth must be positive.')
+
+    # Determine number of grid points.
+    n = len(binned)
+
+    # Take arrays on the grid from the workspace, or else allocate them.
+    # Squared indices are looked up in the cache for each grid size.
+    if workspace is None:
+        normalized = asarray(binned, dtype=dtype) / float(N)
+        (a2, moments, decay, kernel) = (None, None, None, None)
+        k2 = squares(n)
+    else:
+        (k2,) = workspace.k2
+        normalized = workspace.buffer
+        copyto(normalized, binned)
+        normalized /= N
+        (a2, moments, decay, (kernel,)) = (workspace.a2, workspace.moments,
+                                           workspace.decay, workspace.filters)
+
+    # Compute discrete cosine transform, then adjust first component.
+    transformed = dct(normalized, workers=workers, overwrite_x=True)
+    del normalized
     transformed[0] /= 2
 
-    # Pre-compute squared indices and transform components before solver loop.
-    k  = arange(n, dtype='float')      # "float" avoids integer overflow.
-    k2 = k**2
-    a2 = (transformed/2)**2
+    # Find optimal diffusion time t*, unless the bandwidth is given.
+    if bandwidth is None:
+        (ts, info) = optimize(transformed, N, guess, a2, moments, decay,
+                              k2)
+    else:
+        (ts, info) = ((bandwidth/Δx)**2, None)
+
+    # Stop here if only the bandwidth was asked for.
+    if bandwidth_only:
+        return (None, sqrt(ts) * Δx, info)
+
+    # Apply Gaussian filter with optimized kernel.
+    kernel = multiply(k2, -π**2 * ts/2, out=kernel)
+    exp(kernel, out=kernel)
+    smoothed = transformed
+    smoothed *= kernel
+
+    # Reverse transformation after adjusting first component.
+    smoothed[0] *= 2
+    inverse = idct(smoothed, workers=workers, overwrite_x=True)
+
+    # Normalize density, in the output array if given, but never in
+    # the workspace, which the next estimate will overwrite.
+    if out is not None:
+        density = multiply(inverse, n/Δx, out=out)
+    elif workspace is not None:
+        density = inverse * float(n/Δx)
+    else:
+        density = inverse
+        density *= n/Δx
+
+    # Determine bandwidth from diffusion time.
+    bandwidth = sqrt(ts) * Δx
+
+    # Return results.
+    return (density, bandwidth, info)
+
+
+def optimize(transformed, N, guess=None, a2=None, moments=None, decay=None,
+             k2=None):
+    """
+    Returns the optimal diffusion time t* and the results of its search.
+
+    `transformed` holds the components of the transformed histogram,
+    with the first one adjusted, and `N` is the number of data points.
+    The root search starts from a `guess`, if given, as explained for
+    `estimate`. Arrays `a2`, `moments`, and `decay` receive the squared
+    transform components, the weighted ones of each order, and the
+    decay factors, and are allocated if not passed in. The squared
+    indices `k2` are looked up in the cache if not passed in.
+    """
+
+    # Look up the squared indices, cached for each grid size.
+    n = len(transformed)
+    if k2 is None:
+        k2 = squares(n)
+    if moments is None:
+        moments = empty((8, n))
+    if decay is None:
+        decay = empty(n)
+
+    # Pre-compute squared transform components and, for each order l
+    # of the solver loop below, the weighted ones that enter the sum,
+    # each order from the one below.
+    a2 = square(transformed, out=a2, dtype='float64')
+    a2 /= 4
+    multiply(a2, 2, out=moments[0])
+    for l in range(1, 8):
+        multiply(moments[l-1], k2, out=moments[l])
+        moments[l] *= π**2
+
+    def Σ(l, t):
+        """Returns the sum over all components of order l at time t."""
+        multiply(k2, -π**2 * t, out=decay)
+        exp(decay, out=decay)
+        return moments[l] @ decay
 
     # Define internal function to be solved iteratively.
+    (Ks, Cs) = (doubles / sqrt(2*π), factors(1))
+
     def ξγ(t, l=7):
         """Returns ξ γ^[l] as a function of diffusion time t."""
-        f = 2*π**(2*l) * sum(k2**l * a2 * exp(-π**2 * k2*t))
+        f = Σ(l, t)
         for s in range(l-1, 1, -1):
-            K = product(range(1, 2*s, 2)) / sqrt(2*π)
-            C = (1 + (1/2)**(s+1/2)) / 3
+            (K, C) = (Ks[s], Cs[s])
             t = (2*C*K/N/f)**(2/(3+2*s))
-            f = 2*π**(2*s) * sum(k2**s * a2 * exp(-π**2 * k2*t))
+            f = Σ(s, t)
         return (2*N*sqrt(π)*f)**(-2/5)
 
     # Solve for optimal diffusion time t*.
     try:
-        ts = brentq(lambda t: t - ξγ(t), 0, 0.1)
+        (ts, info) = solve(lambda t: t - ξγ(t), guess, 0, 0.1)
     except ValueError:
         raise ValueError('Bandwidth optimization did not converge.') from None
 
-    # Apply Gaussian filter with optimized kernel.
-    smoothed = transformed * exp(-π**2 * ts/2 * k**2)
-
-    # Reverse transformation after adjusting first component.
-    smoothed[0] *= 2
-    inverse = idct(smoothed)
-
-    # Normalize density.
-    density = inverse * n/Δx
-
-    # Determine bandwidth from diffusion time.
-    bandwidth = sqrt(ts) * Δx
-
     # Return results.
-    return (density, grid, bandwidth)
+    return (ts, info)
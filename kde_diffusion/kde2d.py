@@ -4,29 +4,36 @@
 ########################################
 # Dependencies                         #
 ########################################
-from numpy import array, arange
-from numpy import exp, sqrt, pi as π
-from numpy import ceil, log2
-from numpy import ones
-from numpy import prod as product, outer
-from numpy import histogram2d
+from .kde1d import bounds as bounds1d, size
+from .binning import histogram2d
+from .workspace import check
+from .constants import squares, powers, doubles, factors
+from numpy import array, asarray, arange, linspace, copyto
+from numpy import exp, sqrt, square, multiply, pi as π
+from numpy import outer, ndim
 from scipy.fft import dctn, idctn
-from scipy.optimize import brentq
+from .solver import solve
 
 
 ########################################
 # Main                                 #
 ########################################
 
-def kde2d(x, y, n=256, limits=None):
+def kde2d(x, y, n=256, limits=None, workers=None, rounding='power',
+          dtype='float64', low_memory=False, out=None, workspace=None,
+          bandwidth=None, bandwidth_only=False, guess=None,
+          full_output=False):
     """
     Estimates the 2d density from discrete observations.
 
     The input is two lists/arrays `x` and `y` of numbers that represent
     discrete observations of a random variable with two coordinate
-    components. The observations are binned on a grid of n×n points.
-    `n` will be coerced to the next highest power of two if it isn't
-    one to begin with.
+    components. The observations are binned on a grid of n×n points,
+    or nx×ny points if `n` is a tuple `(nx, ny)`, so that the resolution
+    can differ between the axes. Each will be coerced to the next
+    highest power of two if it isn't one to begin with, or to the next
+    fast transform length if `rounding` is `'fast'`, as explained for
+    [`kde1d`](#kde1d).
 
     Data `limits` may be specified as a tuple of tuples denoting
     `((xmin, xmax), (ymin, ymax))`. If any of the values are `None`,
@@ -39,11 +46,43 @@ def kde2d(x, y, n=256, limits=None):
     binned data over the grid using a Gaussian kernel with a standard
     deviation corresponding to that bandwidth.
 
+    The binning as well as the cosine transformations may be split
+    among several threads, given by `workers`. A negative number counts
+    back from the number of CPU cores, so `-1` uses all of them. If not
+    given, the default set by SciPy's [`set_workers`](#scipy.fft.set_workers)
+    context manager applies, which is one thread unless changed.
+
+    With `dtype='float32'`, the transformations and the smoothing run
+    in single precision, which halves the memory taken up by the arrays
+    on the grid, of which several are alive at the same time. Only the
+    squared transform components that enter the bandwidth optimization
+    are kept in double precision, as is the optimization itself. The
+    bandwidth is then nearly the same as in double precision, but the
+    density only accurate to about six significant digits, relative to
+    its maximum.
+
+    With `low_memory=True`, the intermediate results are computed in
+    place, as far as possible, so that peak memory use comes close to
+    two arrays the size of the grid, instead of several. The results
+    agree with those of the default mode to within floating-point
+    round-off. Arguments `out` and `workspace` allow the arrays on the
+    grid to be reused across calls, as explained for `kde1d`.
+
+    A known `bandwidth` may be passed in, either a single value or a
+    tuple of values along x and y, to skip the optimization and smooth
+    the data right away. With `bandwidth_only=True`, on the other hand,
+    only the optimal bandwidth values are determined and returned.
+    A `guess` of the optimal diffusion time lets the search for it
+    start from there, as explained for `kde1d`.
+
     Returns the estimated `density` and the `grid` (along each of the
     two axes) upon which it was computed, as well as the optimal
     `bandwidth` values (per axis) that the algorithm determined.
     Raises `ValueError` if the algorithm did not converge or `x` and
     `y` are not the same length.
+
+    If `full_output` is `True`, the results of the root search for the
+    optimal diffusion time are returned as well, just like by `kde1d`.
     """
 
     # Convert to arrays in case lists are passed in.
@@ -55,33 +94,136 @@ def kde2d(x, y, n=256, limits=None):
     if len(y) != N:
         raise ValueError('x and y must have the same length.')
 
-    # Round up number of bins to next power of two.
-    n = int(2**ceil(log2(n)))
+    # Round up number of bins to next power of two or fast length.
+    (nx, ny) = sizes(n, rounding)
+    check(workspace, (nx, ny), dtype)
 
     # Determine missing data limits.
-    if limits is None:
-        xmin = xmax = ymin = ymax = None
-    elif isinstance(limits, tuple):
+    ((xmin, xmax), (ymin, ymax)) = extent(x, y, limits)
+    Δx = xmax - xmin
+    Δy = ymax - ymin
+
+    # Bin samples on regular grid, in the workspace if given.
+    counts = None if workspace is None else workspace.counts
+    (binned, (xedges, yedges)) = histogram2d(x, y, (nx, ny),
+                                             ((xmin, xmax), (ymin, ymax)),
+                                             workers=workers, out=counts)
+    grid = (xedges[:-1], yedges[:-1])
+
+    # Estimate density from histogram, possibly overwriting it.
+    if low_memory and workspace is None:
+        binned = binned.astype(dtype)
+    (density, bandwidth, info) = estimate(binned, N, Δx, Δy, workers, dtype,
+                                          overwrite=low_memory, out=out,
+                                          workspace=workspace,
+                                          bandwidth=bandwidth,
+                                          bandwidth_only=bandwidth_only,
+                                          guess=guess)
+
+    # Return results.
+    if bandwidth_only:
+        return (bandwidth, info) if full_output else bandwidth
+    if full_output:
+        return (density, grid, bandwidth, info)
+    return (density, grid, bandwidth)
+
+
+def kde2d_binned(binned, limits, N=None, workers=None, dtype='float64',
+                 out=None, workspace=None, bandwidth=None,
+                 bandwidth_only=False, guess=None, full_output=False):
+    """
+    Estimates the 2d density from observations already binned.
+
+    `binned` is a matrix of the counts of observations on a regular
+    grid within the data `limits`, indexed x before y. Limits may be
+    given in any of the forms accepted by [`kde2d`](#kde2d), but may not
+    contain `None`. The grid size is not constrained to powers of two,
+    and may differ between the axes. `N` is the total number of
+    observations, including any outside the limits. It defaults to the
+    sum of all counts.
+
+    As with [`kde1d_binned`](#kde1d_binned), the run time does not
+    depend on the number of observations, and the results are the same
+    as those of `kde2d` for the same counts: the estimated `density`,
+    the `grid`, and the `bandwidth` values, with `workers`, `dtype`,
+    `out`, `workspace`, `bandwidth`, `bandwidth_only`, `guess`, and
+    `full_output` meaning the same as for `kde2d`, as does the fourth
+    item returned with the latter. Raises `ValueError` if the
+    algorithm did not converge or the limits are incomplete.
+    """
+
+    # Convert to array in case a list is passed in.
+    binned = asarray(binned)
+    (nx, ny) = binned.shape
+    check(workspace, (nx, ny), dtype)
+
+    # Unpack data limits, which cannot be inferred.
+    ((xmin, xmax), (ymin, ymax)) = bounds(limits)
+    if None in (xmin, xmax, ymin, ymax):
+        raise ValueError('Limits of binned data must be given.')
+    Δx = xmax - xmin
+    Δy = ymax - ymin
+
+    # Count data points unless specified.
+    if N is None:
+        N = binned.sum()
+
+    # Construct grid from bin edges.
+    grid = (linspace(xmin, xmax, nx+1)[:-1], linspace(ymin, ymax, ny+1)[:-1])
+
+    # Estimate density from histogram.
+    (density, bandwidth, info) = estimate(binned, N, Δx, Δy, workers, dtype,
+                                          out=out, workspace=workspace,
+                                          bandwidth=bandwidth,
+                                          bandwidth_only=bandwidth_only,
+                                          guess=guess)
+
+    # Return results.
+    if bandwidth_only:
+        return (bandwidth, info) if full_output else bandwidth
+    if full_output:
+        return (density, grid, bandwidth, info)
+    return (density, grid, bandwidth)
+
+
+########################################
+# Internal                             #
+########################################
+
+def bounds(limits):
+    """
+    Returns the bounds `((xmin, xmax), (ymin, ymax))` given by `limits`.
+
+    Accepts the same forms of `limits` as `kde2d`. Any of the bounds
+    may be returned as `None`, meaning it is to be inferred from data.
+    """
+    if isinstance(limits, tuple):
         (xlimits, ylimits) = limits
-        if xlimits is None:
-            xmin = xmax = None
-        elif isinstance(xlimits, tuple):
-            (xmin, xmax) = xlimits
-        else:
-            xmin = -xlimits
-            xmax = +xlimits
-        if ylimits is None:
-            ymin = ymax = None
-        elif isinstance(ylimits, tuple):
-            (ymin, ymax) = ylimits
-        else:
-            ymin = -ylimits
-            ymax = +ylimits
+        return (bounds1d(xlimits), bounds1d(ylimits))
+    return (bounds1d(limits), bounds1d(limits))
+
+
+def sizes(n, rounding='power'):
+    """
+    Returns the grid sizes `(nx, ny)` for `n`, either a single number
+    or a tuple, each rounded up as per `rounding`.
+    """
+    if isinstance(n, tuple):
+        (nx, ny) = n
     else:
-        xmin = -limits
-        xmax = +limits
-        ymin = -limits
-        ymax = +limits
+        nx = ny = n
+    return (size(nx, rounding), size(ny, rounding))
+
+
+def extent(x, y, limits):
+    """
+    Returns the data limits `((xmin, xmax), (ymin, ymax))` for the
+    observations with coordinates `x` and `y`.
+
+    Bounds that `limits` leaves open are inferred from the data range,
+    extended by a quarter of its width on either side.
+    """
+    ((xmin, xmax), (ymin, ymax)) = bounds(limits)
     if None in (xmin, xmax):
         delta = x.max() - x.min()
         if xmin is None:
@@ -94,54 +236,153 @@ def kde2d(x, y, n=256, limits=None):
             ymin = y.min() - delta/4
         if ymax is None:
             ymax = y.max() + delta/4
-    Δx = xmax - xmin
-    Δy = ymax - ymin
+    return ((xmin, xmax), (ymin, ymax))
 
-    # Bin samples on regular grid.
-    (binned, xedges, yedges) = histogram2d(x, y, bins=n,
-                                           range=((xmin, xmax), (ymin, ymax)))
-    grid = (xedges[:-1], yedges[:-1])
+
+def estimate(binned, N, Δx, Δy, workers=None, dtype='float64',
+             overwrite=False, out=None, workspace=None, bandwidth=None,
+             bandwidth_only=False, guess=None):
+    """
+    Estimates the density from the `binned` observations.
+
+    `binned` holds the counts on the regular nx×ny grid, `N` is the total
+    number of observations, and `Δx` and `Δy` are the widths of the
+    grid's range along either axis. The transformations run on the
+    given number of `workers`, in the floating-point `dtype`, while the
+    root search is in double precision. Returns the `density` on the
+    grid, the optimal `bandwidth` values, and the results of the root
+    search for the optimal diffusion time.
+
+    If `overwrite` is true, `binned` must be an array of the given
+    `dtype`. It is then used as working space, and eventually holds
+    the density. The transformations are done in place, and the filter
+    is applied one axis at a time.
+
+    The density is written to `out`, if given. If a `workspace` is
+    given, the counts are copied to its buffer, which is then
+    overwritten, and all other arrays on the grid are taken from it
+    as well.
+
+    If the `bandwidth` is given, either a single value or one per axis,
+    the root search is skipped, and its results returned as `None`.
+    With `bandwidth_only`, the density is not computed, but returned as
+    `None`. The root search starts from the `guess`, if given.
+    """
+
+    # Make sure a given bandwidth can be used.
+    if bandwidth is not None:
+        if bandwidth_only:
+            raise ValueError('Bandwidth cannot be given if it is to be found.')
+        if not (asarray(bandwidth) > 0).all():
+            raise ValueError('Bandwidth must be positive.')
+
+    # Determine number of grid points per axis.
+    (nx, ny) = binned.shape
+
+    # Work in the workspace, if given, so nothing needs to be allocated.
+    if workspace is not None:
+        copyto(workspace.buffer, binned)
+        binned = workspace.buffer
+        overwrite = True
 
     # Compute discrete cosine transform, then adjust first component.
-    transformed = dctn(binned/N)
+    if overwrite:
+        normalized = binned
+        normalized /= N
+    else:
+        normalized = asarray(binned, dtype=dtype) / float(N)
+    transformed = dctn(normalized, workers=workers, overwrite_x=overwrite)
+    del normalized
     transformed[0, :] /= 2
     transformed[:, 0] /= 2
 
-    # Pre-compute squared indices and transform components before solver loop.
-    k  = arange(n, dtype='float')          # "float" avoids integer overflow.
-    k2 = k**2
-    a2 = transformed**2
+    # Look up squared indices, cached for each grid size, unless the
+    # workspace holds them already.
+    if workspace is None:
+        k2 = (squares(nx), squares(ny))
+    else:
+        k2 = workspace.k2
+
+    # Find optimal diffusion times, unless the bandwidth is given.
+    if bandwidth is None:
+        a2 = None if workspace is None else workspace.a2
+        (tx1, tx2, info) = optimize(transformed, N, a2, guess)
+    else:
+        if ndim(bandwidth) == 0:
+            bandwidth = (bandwidth, bandwidth)
+        (hx, hy) = bandwidth
+        (tx1, tx2, info) = ((hy/Δy)**2, (hx/Δx)**2, None)
+
+    # Stop here if only the bandwidth was asked for.
+    if bandwidth_only:
+        return (None, array([sqrt(tx2)*Δx, sqrt(tx1)*Δy]), info)
+
+    # Apply Gaussian filter with optimized kernel.
+    (fx, fy) = (None, None) if workspace is None else workspace.filters
+    fx = exp(multiply(k2[0], -π**2 * tx2/2, out=fx), out=fx)
+    fy = exp(multiply(k2[1], -π**2 * tx1/2, out=fy), out=fy)
+    if overwrite:
+        smoothed = transformed
+        smoothed *= fx[:, None]
+        smoothed *= fy
+    else:
+        smoothed = transformed * outer(fx.astype(dtype), fy.astype(dtype))
+
+    # Reverse transformation after adjusting first component.
+    smoothed[0, :] *= 2
+    smoothed[:, 0] *= 2
+    inverse = idctn(smoothed, workers=workers, overwrite_x=overwrite)
+
+    # Normalize density, in the output array if given, but never in
+    # the workspace, which the next estimate will overwrite.
+    if out is not None:
+        density = multiply(inverse, nx/Δx * ny/Δy, out=out)
+    elif workspace is not None:
+        density = inverse * float(nx/Δx * ny/Δy)
+    else:
+        density = inverse
+        density *= nx/Δx * ny/Δy
 
-    # Define internal functions to be solved iteratively.
+    # Determine bandwidth from diffusion times.
+    bandwidth = array([sqrt(tx2)*Δx, sqrt(tx1)*Δy])
+
+    # Return results.
+    return (density, bandwidth, info)
+
+
+def optimize(transformed, N, a2=None, guess=None):
+    """
+    Returns the optimal diffusion times and the results of the search.
+
+    `transformed` holds the components of the transformed histogram,
+    with the first ones adjusted, and `N` is the number of data points.
+    The squared components are written to `a2`, if given, or else to an
+    array that is released when done. The root search starts from the
+    `guess`, if given. Returns the diffusion times tx1 and tx2, along y
+    and x respectively, as explained below, and the results of the root
+    search for the common diffusion time t*.
+    """
+
+    # Look up squared indices, pre-compute squared transform components.
+    (nx, ny) = transformed.shape
+    k2 = (squares(nx), squares(ny))
+    a2 = square(transformed, out=a2, dtype='float64')
+
+    # Define internal function to be solved iteratively.
     def γ(t):
-        Σ = ψ(0, 2, t) + ψ(2, 0, t) + 2*ψ(1, 1, t)
+        (ψ02, ψ11, ψ20) = functionals(t, N, a2, k2)
+        Σ = ψ02 + ψ20 + 2*ψ11
         γ = (2*π*N*Σ)**(-1/3)
         return (t - γ) / γ
 
-    def ψ(i, j, t):
-        if i + j <= 4:
-            Σ  = abs(ψ(i+1, j, t) + ψ(i, j+1, t))
-            C  = (1 + 1/2**(i+j+1)) / 3
-            Πi = product(arange(1, 2*i, 2))
-            Πj = product(arange(1, 2*j, 2))
-            t  = (C*Πi*Πj / (π*N*Σ)) ** (1/(2+i+j))
-        w = 0.5 * ones(n)
-        w[0] = 1
-        w = w * exp(-π**2 * k2*t)
-        wx = w * k2**i
-        wy = w * k2**j
-        return (-1)**(i+j) * π**(2*(i+j)) * wy @ a2 @ wx
-
     # Solve for optimal diffusion time t*.
     try:
-        ts = brentq(lambda t: t - γ(t), 0, 0.1)
+        (ts, info) = solve(lambda t: t - γ(t), guess, 0, 0.1)
     except ValueError:
         raise ValueError('Bandwidth optimization did not converge.') from None
 
     # Calculate diffusion times along x- and y-axis.
-    ψ02 = ψ(0, 2, ts)
-    ψ20 = ψ(2, 0, ts)
-    ψ11 = ψ(1, 1, ts)
+    (ψ02, ψ11, ψ20) = functionals(ts, N, a2, k2)
     tx1 = (ψ02**(3/4) / (4*π*N*ψ20**(3/4) * (ψ11 + sqrt(ψ02*ψ20))) )**(1/3)
     tx2 = (ψ20**(3/4) / (4*π*N*ψ02**(3/4) * (ψ11 + sqrt(ψ02*ψ20))) )**(1/3)
 
@@ -158,20 +399,55 @@ def kde2d(x, y, n=256, limits=None):
     # only employs one matrix transposition, not two as its forward
     # counterpart (dct2d).
 
-    # Apply Gaussian filter with optimized kernel.
-    smoothed = transformed * outer(exp(-π**2 * k2 * tx2/2),
-                                   exp(-π**2 * k2 * tx1/2))
+    # Return results.
+    return (tx1, tx2, info)
 
-    # Reverse transformation after adjusting first component.
-    smoothed[0, :] *= 2
-    smoothed[:, 0] *= 2
-    inverse = idctn(smoothed)
 
-    # Normalize density.
-    density = inverse * n/Δx * n/Δy
+def functionals(t, N, a2, k2):
+    """
+    Returns the functionals ψ02, ψ11, and ψ20 at diffusion time `t`.
 
-    # Determine bandwidth from diffusion times.
-    bandwidth = array([sqrt(tx2)*Δx, sqrt(tx1)*Δy])
+    `N` is the number of data points, `a2` the squared components of
+    the transformed histogram, and `k2` the squared indices, or a tuple
+    of those along the x- and y-axis if the grid is not square. Their
+    powers, as well as the constants of each order, are looked up in
+    the cache rather than computed for each call. `t` and
+    `N` may also be arrays, with `a2` then holding one matrix for each
+    of their elements, in which case the functionals are returned as
+    arrays as well.
 
-    # Return results.
-    return (density, grid, bandwidth)
+    The functionals of order s = i+j follow from those of order s+1
+    via ψ(i,j), which needs ψ(i+1,j) and ψ(i,j+1) to determine its
+    own diffusion time. The recursion ends at order 5, where all
+    functionals are evaluated at `t` itself. Rather than recursing
+    from each of the three results, every functional is computed only
+    once, level by level, with all contractions `wy @ a2 @ wx` of a
+    level stacked into a single matrix product. Following the paper's
+    nomenclature, explained in `optimize`, `wy` weighs the first axis
+    of `a2`, along x, and `wx` the second one, along y. On non-square
+    grids, the products are non-square as well.
+    """
+    t = asarray(t, dtype='float')[..., None]
+    N = asarray(N)[..., None]
+    (k2x, k2y) = k2 if isinstance(k2, tuple) else (k2, k2)
+    (xpowers, ypowers) = (powers(len(k2x)), powers(len(k2y)))
+    ψ = None
+    for s in range(5, 1, -1):
+        i = arange(s+1)
+        j = s - i
+        if ψ is None:
+            ts = t
+        else:
+            Σ  = abs(ψ[..., 1:] + ψ[..., :-1])
+            C  = factors(2)[s]
+            Πi = doubles[i]
+            Πj = doubles[j]
+            ts = (C*Πi*Πj / (π*N*Σ)) ** (1/(2+s))
+        u = 0.5 * exp(-π**2 * k2x * ts[..., None])
+        u[..., 0] *= 2
+        v = 0.5 * exp(-π**2 * k2y * ts[..., None])
+        v[..., 0] *= 2
+        wx = v * ypowers[i]
+        wy = u * xpowers[j]
+        ψ = (-1)**s * π**(2*s) * ((wy @ a2) * wx).sum(axis=-1)
+    return (ψ[..., 0], ψ[..., 1], ψ[..., 2])
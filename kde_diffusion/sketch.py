@@ -0,0 +1,246 @@
+﻿"""Mergeable histogram sketches for distributed density estimation."""
+
+
+########################################
+# Dependencies                         #
+########################################
+from .streaming import StreamingKDE1d
+from .binning import histogram2d
+from .kde2d import kde2d_binned, bounds as bounds2d, sizes
+from numpy import asarray, zeros, linspace, array, arange, frombuffer
+from numpy import concatenate, cumsum, diff, flatnonzero
+from numpy import add
+from numpy import uint8, uint64, float64
+from struct import Struct
+
+
+########################################
+# Format                               #
+########################################
+
+magic = b'KDEs'
+"""Marks the start of serialized sketches."""
+
+header = Struct('<4sBB')
+"""Binary layout of magic marker, format version, and dimensions."""
+
+
+########################################
+# 1d                                   #
+########################################
+
+class Sketch1d(StreamingKDE1d):
+    """
+    Histogram of 1d observations that can be merged and serialized.
+
+    Works like [`StreamingKDE1d`](#StreamingKDE1d), but is meant for
+    estimating the density from observations that are spread across
+    many processes or machines. Each of them bins its share of the data
+    in a sketch with the same `limits` and grid size `n`. The sketches
+    are then shipped to one place, in serialized form, and merged. The
+    final density is the same as that of a single call of `kde1d` with
+    all observations.
+    """
+
+    def merge(self, other):
+        """
+        Adds the counts of the `other` sketch to this one.
+
+        Returns the sketch itself. Raises `ValueError` if the sketches
+        are not compatible, i.e. their grids differ.
+        """
+        merge(self, other)
+        return self
+
+    def to_bytes(self):
+        """
+        Returns the sketch serialized as compact binary data.
+
+        Only the non-zero counts are stored, along with their distance
+        to the previous one, all as variable-length integers.
+        """
+        return serialize(self, [self.n])
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Returns the sketch de-serialized from binary `data`."""
+        (shape, limits, N, counts) = deserialize(data, 1)
+        sketch = cls(limits, *shape)
+        sketch.counts[:] = counts
+        sketch.N = N
+        return sketch
+
+    def finalize(self):
+        """
+        Estimates the density from the merged counts.
+
+        Returns the estimated `density`, the `grid`, and the `bandwidth`,
+        just like [`density`](#StreamingKDE1d.density).
+        """
+        return self.density()
+
+
+########################################
+# 2d                                   #
+########################################
+
+class Sketch2d:
+    """
+    Histogram of 2d observations that can be merged and serialized.
+
+    The 2d counterpart of [`Sketch1d`](#Sketch1d). The `limits` must
+    be specified in full, in any of the forms accepted by
+    [`kde2d`](#kde2d), as they cannot be inferred from the data. The
+    grid has n×n points, or nx×ny if `n` is a tuple `(nx, ny)`, with
+    each coerced to the next highest power of two if it isn't one to
+    begin with.
+    """
+
+    def __init__(self, limits, n=256):
+        ((xmin, xmax), (ymin, ymax)) = bounds2d(limits)
+        if None in (xmin, xmax, ymin, ymax):
+            raise ValueError('Limits must be given for sketches.')
+        (nx, ny) = sizes(n)
+        self.n = nx if nx == ny else (nx, ny)
+        self.limits = ((xmin, xmax), (ymin, ymax))
+        self.grid   = (linspace(xmin, xmax, nx+1)[:-1],
+                       linspace(ymin, ymax, ny+1)[:-1])
+        self.counts = zeros((nx, ny), dtype='int64')
+        self.N      = 0
+
+    def partial_fit(self, x, y):
+        """
+        Adds the observations with coordinates `x` and `y` to the
+        histogram. Returns the sketch itself. Raises `ValueError` if
+        `x` and `y` are not the same length.
+        """
+        x = asarray(x)
+        y = asarray(y)
+        if len(y) != len(x):
+            raise ValueError('x and y must have the same length.')
+        (binned, _) = histogram2d(x, y, self.counts.shape, self.limits)
+        self.counts += binned
+        self.N += len(x)
+        return self
+
+    def merge(self, other):
+        """
+        Adds the counts of the `other` sketch to this one.
+
+        Returns the sketch itself. Raises `ValueError` if the sketches
+        are not compatible, i.e. their grids differ.
+        """
+        merge(self, other)
+        return self
+
+    def to_bytes(self):
+        """Returns the sketch serialized as compact binary data."""
+        return serialize(self, list(self.counts.shape))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Returns the sketch de-serialized from binary `data`."""
+        (shape, limits, N, counts) = deserialize(data, 2)
+        sketch = cls(limits, tuple(shape))
+        sketch.counts[:] = counts.reshape(sketch.counts.shape)
+        sketch.N = N
+        return sketch
+
+    def density(self):
+        """
+        Estimates the density from all observations added so far.
+
+        Returns the estimated `density`, the `grid` upon which it was
+        computed, and the optimal `bandwidth` values, just like `kde2d`.
+        Raises `ValueError` if no observations were added yet or if
+        the algorithm did not converge.
+        """
+        if self.N == 0:
+            raise ValueError('No observations were added yet.')
+        return kde2d_binned(self.counts, self.limits, self.N)
+
+    def finalize(self):
+        """Estimates the density from the merged counts."""
+        return self.density()
+
+
+########################################
+# Internal                             #
+########################################
+
+def merge(sketch, other):
+    """Adds the counts of the `other` sketch to those of `sketch`."""
+    if (type(other) is not type(sketch)
+            or other.counts.shape != sketch.counts.shape
+            or other.limits != sketch.limits):
+        raise ValueError('Sketches are not compatible.')
+    sketch.counts += other.counts
+    sketch.N += other.N
+
+
+def serialize(sketch, shape):
+    """Returns the binary representation of the `sketch`."""
+    limits = array(sketch.limits, dtype=float64).ravel()
+    index  = flatnonzero(sketch.counts)
+    values = concatenate(([sketch.N, len(index)], shape,
+                          diff(index, prepend=0), sketch.counts.flat[index]))
+    return (header.pack(magic, 1, len(shape)) + limits.tobytes()
+            + encode(values.astype(uint64)))
+
+
+def deserialize(data, dimensions):
+    """
+    Returns grid shape, limits, number of observations, and the counts
+    from the binary `data` of a sketch with the given `dimensions`.
+    """
+    (marker, version, d) = header.unpack_from(data)
+    if marker != magic or version != 1 or d != dimensions:
+        raise ValueError('Data does not represent a sketch of this type.')
+    start  = header.size
+    stop   = start + 2*d*8
+    limits = frombuffer(data[start:stop], dtype=float64).tolist()
+    if d == 1:
+        limits = tuple(limits)
+    else:
+        limits = (tuple(limits[:2]), tuple(limits[2:]))
+    values = decode(data[stop:])
+    (N, m) = (int(values[0]), int(values[1]))
+    shape  = [int(value) for value in values[2:2+d]]
+    index  = cumsum(values[2+d : 2+d+m])
+    counts = zeros(int(array(shape).prod()), dtype='int64')
+    counts[index.astype('int64')] = values[2+d+m : 2+d+2*m]
+    return (shape, limits, N, counts)
+
+
+def encode(values):
+    """Encodes unsigned integers as variable-length byte sequences."""
+    sizes = zeros(len(values), dtype='int64') + 1
+    rest  = values >> uint64(7)
+    while rest.any():
+        sizes += rest > 0
+        rest >>= uint64(7)
+    starts = cumsum(sizes) - sizes
+    output = zeros(sizes.sum(), dtype=uint8)
+    rest   = values.copy()
+    for position in range(sizes.max(initial=0)):
+        active = sizes > position
+        more   = sizes[active] > position + 1
+        output[starts[active] + position] = (
+            (rest[active] & uint64(0x7F)) | (more.astype(uint64) << uint64(7))
+        )
+        rest >>= uint64(7)
+    return output.tobytes()
+
+
+def decode(data):
+    """Decodes the variable-length byte sequences into integers."""
+    data = frombuffer(data, dtype=uint8)
+    last = (data & 0x80) == 0
+    ends = flatnonzero(last)
+    if len(ends) == 0:
+        return zeros(0, dtype=uint64)
+    starts = concatenate(([0], ends[:-1] + 1))
+    owner  = cumsum(last) - last
+    shift  = (arange(len(data)) - starts[owner]) * 7
+    terms  = (data & 0x7F).astype(uint64) << shift.astype(uint64)
+    return add.reduceat(terms, starts)
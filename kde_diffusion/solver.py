@@ -0,0 +1,204 @@
+﻿"""Root finding for the optimal diffusion time."""
+
+
+########################################
+# Dependencies                         #
+########################################
+from numpy import asarray, full, arange
+from numpy import abs, sign, where, isfinite, inf, finfo
+from scipy.optimize import brentq
+
+
+########################################
+# Vectorized                           #
+########################################
+
+def roots(f, a, b, xtol=2e-12, rtol=8.88e-16, maxiter=100):
+    """
+    Finds the roots of many scalar functions at once.
+
+    `f` is called with an array of arguments and an integer array
+    selecting which of the functions to evaluate at those arguments.
+    It returns the function values as an array. Each root must be
+    bracketed by the corresponding entries in `a` and `b`, meaning
+    the function values there have opposite signs.
+
+    All roots are refined simultaneously by false position with the
+    Illinois modification, falling back to bisection whenever a step
+    does not at least halve the bracket. Functions that have converged
+    to within the same tolerances as SciPy's [`brentq`](#scipy.optimize.brentq)
+    are no longer evaluated.
+
+    Returns the array of roots. Raises `ValueError` if a root is not
+    bracketed or did not converge within `maxiter` iterations.
+    """
+
+    # Evaluate all functions at the bracket limits.
+    a  = asarray(a, dtype='float').copy()
+    b  = asarray(b, dtype='float').copy()
+    m  = len(a)
+    fa = f(a, arange(m))
+    fb = f(b, arange(m))
+    if (sign(fa) * sign(fb) > 0).any() or not isfinite(fa*fb).all():
+        raise ValueError('Roots are not bracketed.')
+
+    # Accept exact hits right away, refine the rest iteratively.
+    x = where(fa == 0, a, b)
+    active = (fa != 0) & (fb != 0)
+    width  = abs(b - a)
+    bisect = full(m, False)
+    for _ in range(maxiter):
+        rows = active.nonzero()[0]
+        if len(rows) == 0:
+            return x
+        (ar, br, fa_, fb_) = (a[rows], b[rows], fa[rows], fb[rows])
+        c = where(bisect[rows], (ar + br)/2, br - fb_ * (br-ar)/(fb_-fa_))
+        fc = f(c, rows)
+        x[rows] = c
+
+        # Keep the bracket. If the new point lies on the same side as the
+        # last one, the other end is retained, and its value halved each
+        # time (Illinois), so that both sides converge.
+        flip = sign(fc) * sign(fb_) < 0
+        fa[rows] = where(flip, fb_, fa_/2)
+        a[rows]  = where(flip, br, ar)
+        b[rows]  = c
+        fb[rows] = fc
+
+        # Bisect next time if the bracket did not shrink fast enough.
+        new = abs(b[rows] - a[rows])
+        bisect[rows] = new > width[rows]/2
+        width[rows]  = new
+        active[rows] = (fc != 0) & (new > xtol + rtol*abs(c))
+
+    raise ValueError('Root finding did not converge.')
+
+
+########################################
+# Scalar                               #
+########################################
+
+class Solution:
+    """
+    Results of a root search by `solve`.
+
+    Has the same attributes as SciPy's
+    [`RootResults`](#scipy.optimize.RootResults): the `root`, the number
+    of `iterations` and of `function_calls`, as well as `converged` and
+    `flag`, which always report success, as `solve` raises an error
+    otherwise.
+    """
+
+    def __init__(self, root, iterations, function_calls):
+        self.root           = root
+        self.iterations     = iterations
+        self.function_calls = function_calls
+        self.converged      = True
+        self.flag           = 'converged'
+
+    def __repr__(self):
+        return (f'Solution(root={self.root}, iterations={self.iterations}, '
+                f'function_calls={self.function_calls})')
+
+
+def solve(f, guess=None, a=0, b=0.1, xtol=2e-12, rtol=8.88e-16,
+          maxiter=100, ratio=1.1, overshoot=0.05, tries=4):
+    """
+    Finds a root of the scalar function `f` between `a` and `b`.
+
+    If a `guess` is given, such as the root found the last time, when
+    `f` has changed only slightly since, the search starts there and
+    a factor of `ratio` away from it. Secant steps from the last two
+    points then usually home in on the root within a few iterations.
+    Each step overshoots the secant's estimate by the fraction given by
+    `overshoot`, so that the root ends up bracketed by two points with
+    values of opposite sign. Until then, steps are limited to four times
+    the previous one, and kept inside the outer bracket from `a` to `b`.
+    Inside the bracket, secant steps are taken as long as they stay
+    within it and it halves at least every other step, and it is
+    bisected otherwise. Steps shorter than the tolerance are extended
+    to it, so that the bracket closes in on the root from both sides.
+
+    Without a guess, or if the root is not bracketed within the given
+    number of `tries`, the root is found by SciPy's
+    [`brentq`](#scipy.optimize.brentq) between `a` and `b`, where `f`
+    must change sign. Either way, the search ends when the bracket is
+    narrower than `xtol + rtol*abs(x)`.
+
+    Returns the root and the `Solution`, which reports the number of
+    iterations and function calls, including those spent on the guess.
+    Raises `ValueError` if the root is not bracketed by `a` and `b` or
+    did not converge within `maxiter` iterations.
+    """
+
+    # Count function calls along the way.
+    calls = 0
+
+    def evaluate(x):
+        nonlocal calls
+        calls += 1
+        return f(x)
+
+    # Look for a bracket near the guess, following secant steps.
+    iterations = 0
+    bracketed  = False
+    if guess is not None and a < guess < b:
+        (p, q) = (guess, guess*ratio if guess*ratio < b else guess/ratio)
+        (fp, fq) = (evaluate(p), evaluate(q))
+        if fp == 0:
+            return (p, Solution(p, iterations, calls))
+        for _ in range(tries+1):
+            if fq == 0:
+                return (q, Solution(q, iterations, calls))
+            if sign(fp) != sign(fq):
+                bracketed = True
+                break
+            if iterations == tries:
+                break
+            iterations += 1
+            step = -fq * (q - p)/(fq - fp) if fq != fp else q - p
+            step = sign(step) * min(abs(step) * (1 + overshoot),
+                                    4*abs(q - p))
+            c = min(max(q + step, (a + q)/2), (q + b)/2)
+            (p, fp, q, fq) = (q, fq, c, evaluate(c))
+
+    # Fall back to Brent's method on the outer bracket.
+    if not bracketed:
+        rtol = max(rtol, 4*finfo(float).eps)
+        (x, results) = brentq(f, a, b, xtol=xtol, rtol=rtol,
+                              maxiter=maxiter, full_output=True, disp=False)
+        if not results.converged:
+            raise ValueError('Root finding did not converge.')
+        solution = Solution(x, iterations + results.iterations,
+                            calls + results.function_calls)
+        return (x, solution)
+
+    # Refine the root inside the bracket from o to q, the latest point.
+    (o, fo) = (p, fp)
+    widths = [inf, inf]
+    for _ in range(maxiter):
+        best  = q if abs(fq) <= abs(fo) else o
+        width = abs(q - o)
+        if width <= xtol + rtol*abs(best):
+            return (best, Solution(best, iterations, calls))
+        iterations += 1
+
+        # Take secant step, or else bisect, but step at least δ.
+        c = q - fq * (q - p)/(fq - fp) if fq != fp else None
+        if (c is None or not min(o, q) < c < max(o, q)
+                or width > widths[0]/2):
+            c = (o + q)/2
+        δ = (xtol + rtol*abs(c))/2
+        if abs(c - q) < δ:
+            c = q + δ * sign(o - q)
+        fc = evaluate(c)
+        if fc == 0:
+            return (c, Solution(c, iterations, calls))
+
+        # Keep the end of the bracket that has the opposite sign.
+        if sign(fc) == sign(fo):
+            (o, fo) = (q, fq)
+        (p, fp, q, fq) = (q, fq, c, fc)
+        widths = [widths[1], width]
+
+    raise ValueError('Root finding did not converge.')
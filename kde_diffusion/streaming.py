@@ -0,0 +1,216 @@
+﻿"""Kernel density estimation via diffusion for streamed 1d data."""
+
+
+########################################
+# Dependencies                         #
+########################################
+from .binning import histogram
+from .kde1d import kde1d_binned, bounds, estimate
+from numpy import asarray, zeros, empty, linspace, arange
+from numpy import ceil, log2
+
+
+########################################
+# Incremental                          #
+########################################
+
+class StreamingKDE1d:
+    """
+    Estimates the 1d density from observations that arrive in chunks.
+
+    Unlike [`kde1d`](#kde1d), which needs all observations at once,
+    this estimator only keeps a running histogram of them. Memory use
+    therefore depends on the number of grid points `n`, but not on the
+    number of observations, and adding a chunk only costs its binning.
+    The more expensive steps, the transformation and the bandwidth
+    optimization, are deferred until the density is requested.
+
+    As the grid cannot be inferred from data that is yet to come, the
+    `limits` are mandatory. They may be given as a tuple (`xmin`,
+    `xmax`) or a single number denoting the upper bound of a range
+    centered at zero. `n` will be coerced to the next highest power
+    of two if it isn't one to begin with.
+
+    Observations outside the limits are counted, but not binned, just
+    as they would be by `kde1d`. The resulting density is thus the same
+    as that from a single call of `kde1d` with all observations.
+    """
+
+    def __init__(self, limits, n=1024):
+        (xmin, xmax) = bounds(limits)
+        if None in (xmin, xmax):
+            raise ValueError('Limits must be given for streamed data.')
+        self.n = int(2**ceil(log2(n)))
+        self.limits = (xmin, xmax)
+        self.grid   = linspace(xmin, xmax, self.n+1)[:-1]
+        self.counts = zeros(self.n, dtype='int64')
+        self.N      = 0
+
+    def partial_fit(self, x):
+        """
+        Adds the observations `x`, a list/array of numbers, to the
+        histogram. Returns the estimator itself.
+        """
+        x = asarray(x)
+        (binned, _) = histogram(x, self.n, self.limits)
+        self.counts += binned
+        self.N += len(x)
+        return self
+
+    def density(self):
+        """
+        Estimates the density from all observations added so far.
+
+        Returns the estimated `density`, the `grid` upon which it was
+        computed, and the optimal `bandwidth`, just like `kde1d`.
+        Raises `ValueError` if no observations were added yet or if
+        the algorithm did not converge.
+        """
+        if self.N == 0:
+            raise ValueError('No observations were added yet.')
+        return kde1d_binned(self.counts, self.limits, self.N)
+
+
+########################################
+# Sliding window                       #
+########################################
+
+class SlidingKDE1d(StreamingKDE1d):
+    """
+    Estimates the 1d density from the most recent observations.
+
+    Works like [`StreamingKDE1d`](#StreamingKDE1d), but only the last
+    `window` observations enter the estimate. Older ones are evicted
+    as new ones arrive. To that end, the estimator keeps the
+    observations in the window, in a ring buffer, in addition to the
+    histogram. Adding a chunk bins it, along with the observations it
+    evicts, which are subtracted from the histogram. The cost of an
+    update thus depends on the size of the chunk, but not that of the
+    window.
+
+    When the density is requested, the search for the optimal diffusion
+    time starts from the one found the last time, as it usually changes
+    little from one window to the next. The density is the same as that
+    from a call of `kde1d` with the observations in the window.
+    """
+
+    def __init__(self, limits, window, n=1024):
+        super().__init__(limits, n)
+        self.window = int(window)
+        self.buffer = empty(self.window)
+        self.start  = 0
+        self.guess  = None
+
+    def partial_fit(self, x):
+        """
+        Adds the observations `x`, a list/array of numbers, to the
+        window, evicting the oldest ones if it overflows. Returns the
+        estimator itself.
+        """
+        x = asarray(x, dtype='float')[-self.window:]
+        excess = self.N + len(x) - self.window
+        if excess > 0:
+            evicted = self.buffer[(self.start + arange(excess)) % self.window]
+            self.counts -= histogram(evicted, self.n, self.limits)[0]
+            self.start = (self.start + excess) % self.window
+            self.N -= excess
+        end = self.start + self.N
+        self.buffer[(end + arange(len(x))) % self.window] = x
+        self.counts += histogram(x, self.n, self.limits)[0]
+        self.N += len(x)
+        return self
+
+    def density(self):
+        """
+        Estimates the density from the observations in the window.
+
+        Returns the estimated `density`, the `grid` upon which it was
+        computed, and the optimal `bandwidth`, just like `kde1d`.
+        Raises `ValueError` if no observations were added yet or if
+        the algorithm did not converge.
+        """
+        if self.N == 0:
+            raise ValueError('No observations were added yet.')
+        (xmin, xmax) = self.limits
+        (density, bandwidth, info) = estimate(self.counts, self.N,
+                                              xmax - xmin, guess=self.guess)
+        self.guess = info.root
+        return (density, self.grid, bandwidth)
+
+
+########################################
+# Decayed                              #
+########################################
+
+class DecayedKDE1d(StreamingKDE1d):
+    """
+    Estimates the 1d density with older observations fading out.
+
+    Works like [`StreamingKDE1d`](#StreamingKDE1d), but each observation
+    is weighted by a factor that halves every `half_life` units of time.
+    A chunk of observations is added at the given `time`, or one unit
+    after the previous chunk if not given, so that the half-life then
+    counts chunks.
+
+    Rather than decaying all bins with every update, the estimator
+    lets the weight of new observations grow by the inverse factor,
+    which has the same effect on the normalized histogram. Only when
+    that factor becomes large are all weights rescaled at once. Weights
+    that then fall below the range of floating-point numbers, after a
+    long gap in time, vanish. The number of observations in the
+    bandwidth selection is replaced by the effective sample size,
+    `(Σw)²/Σw²` for weights `w`, which the estimator keeps as `N`.
+    """
+
+    def __init__(self, limits, half_life, n=1024):
+        super().__init__(limits, n)
+        self.half_life = half_life
+        self.counts  = zeros(self.n)
+        self.now     = 0
+        self.origin  = None
+        self.total   = 0.0
+        self.squares = 0.0
+        self.guess   = None
+
+    def partial_fit(self, x, time=None):
+        """
+        Adds the observations `x`, a list/array of numbers, at the given
+        `time`. Returns the estimator itself.
+        """
+        x = asarray(x)
+        self.now = self.now + 1 if time is None else time
+        if self.origin is None:
+            self.origin = self.now
+        exponent = (self.now - self.origin) / self.half_life
+        if exponent > 64:
+            decay = 2.0**-exponent
+            self.counts  *= decay
+            self.total   *= decay
+            self.squares *= decay**2
+            self.origin   = self.now
+            exponent = 0
+        weight = 2**exponent
+        (binned, _) = histogram(x, self.n, self.limits)
+        self.counts  += binned * weight
+        self.total   += len(x) * weight
+        self.squares += len(x) * weight**2
+        self.N = self.total**2 / self.squares if self.squares > 0 else 0
+        return self
+
+    def density(self):
+        """
+        Estimates the density from the decayed observations.
+
+        Returns the estimated `density`, the `grid` upon which it was
+        computed, and the optimal `bandwidth`, just like `kde1d`.
+        Raises `ValueError` if no observations were added yet or if
+        the algorithm did not converge.
+        """
+        if self.N == 0:
+            raise ValueError('No observations were added yet.')
+        (xmin, xmax) = self.limits
+        binned = self.counts * (self.N / self.total)
+        (density, bandwidth, info) = estimate(binned, self.N, xmax - xmin,
+                                              guess=self.guess)
+        self.guess = info.root
+        return (density, self.grid, bandwidth)
@@ -0,0 +1,72 @@
+﻿"""Reusable arrays for repeated density estimates on grids of one size."""
+
+
+########################################
+# Dependencies                         #
+########################################
+from .constants import indices, squares
+from numpy import zeros, empty, ndim, intp
+from numpy import dtype as datatype
+
+
+########################################
+# Workspace                            #
+########################################
+
+class Workspace:
+    """
+    Arrays that repeated density estimates on grids of one size reuse.
+
+    Services that estimate densities over and over again, on grids of
+    the same size, may pass a workspace to [`kde1d`](#kde1d) or
+    [`kde2d`](#kde2d), or their `_binned` counterparts, so that the
+    arrays on the grid are not allocated anew for every call. `shape`
+    is the number of grid points `n` in 1d, or the tuple `(nx, ny)` in
+    2d, after rounding, and `dtype` the floating-point type in which
+    the transformations run, as passed to the estimators.
+
+    The workspace holds the bin `counts`, the working array `buffer`
+    of the transformations, the squared transform components `a2`, the
+    indices `k` of the cosine components along each axis and their
+    squares `k2`, the kernel's decay factors, or `filters`, along each
+    axis, and, in 1d, the terms of the functionals, or `moments`, and
+    the buffer for their `decay` factors. These are overwritten by each
+    estimate, so a workspace must not be shared by concurrent threads.
+    The indices and their squares are the same read-only arrays for
+    all workspaces of the same size, as they are cached, unless the
+    size exceeds the cache's `limit`.
+    """
+
+    def __init__(self, shape, dtype='float64'):
+        if ndim(shape) == 0:
+            shape = (shape,)
+        self.shape   = tuple(int(n) for n in shape)
+        self.dtype   = datatype(dtype)
+        self.counts  = zeros(self.shape, dtype=intp)
+        self.buffer  = empty(self.shape, dtype=self.dtype)
+        self.a2      = empty(self.shape)
+        self.k       = tuple(indices(n) for n in self.shape)
+        self.k2      = tuple(squares(n) for n in self.shape)
+        self.filters = tuple(empty(n) for n in self.shape)
+        if len(self.shape) == 1:
+            (n,) = self.shape
+            self.moments = empty((8, n))
+            self.decay   = empty(n)
+
+
+########################################
+# Internal                             #
+########################################
+
+def check(workspace, shape, dtype):
+    """
+    Makes sure the `workspace`, if any, fits the grid.
+
+    Raises `ValueError` if it was not set up for a grid of the given
+    `shape` and for transformations in the given `dtype`.
+    """
+    if workspace is None:
+        return
+    if workspace.shape != tuple(shape) or workspace.dtype != datatype(dtype):
+        raise ValueError(f'Workspace does not fit grid of shape {shape} '
+                         f'and type {dtype}.')
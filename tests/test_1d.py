@@ -1,9 +1,13 @@
 ﻿"""Tests the 1d kernel density estimation."""
 
-from kde_diffusion import kde1d
+from kde_diffusion import kde1d, kde1d_binned, Workspace
+from kde_diffusion import constants
 from pathlib       import Path
-from numpy         import isclose, load
+from numpy         import isclose, load, tile, histogram, interp, empty
 from pytest        import raises
+from scipy.fft     import set_workers
+from tracemalloc   import start, stop, get_traced_memory
+from concurrent.futures import ThreadPoolExecutor
 
 
 reference = None
@@ -38,3 +42,190 @@ def test_arguments():
     assert isclose(grid.max(), +1)
     with raises(ValueError):
         kde1d([-2, -1, 0, +1, +2]*10, 4)
+    with raises(ValueError):
+        kde1d([-2, -1, 0, +1, +2]*20, 4, rounding='odd')
+
+
+def test_rounding():
+    x = reference['x']
+    (density, grid, bandwidth) = kde1d(x, 300, 5, rounding='fast')
+    assert len(grid) == 300
+    assert len(density) == 300
+    assert isclose(bandwidth, reference['bandwidth'], rtol=1e-2)
+    expected = interp(grid, reference['grid'], reference['density'])
+    assert isclose(density, expected, atol=1e-2).all()
+    (density, grid, bandwidth) = kde1d(x, 256, 5, rounding='fast')
+    assert isclose(density, reference['density']).all()
+    (density, grid, bandwidth) = kde1d(x, 250, 5, rounding='fast')
+    assert len(grid) == 250
+
+
+def test_dtype():
+    x = reference['x']
+    n = reference['n']
+    (density, grid, bandwidth) = kde1d(x, n, 5, dtype='float32')
+    assert density.dtype == 'float32'
+    expected = reference['density']
+    assert isclose(density, expected, atol=1e-6*expected.max()).all()
+    assert isclose(grid, reference['grid']).all()
+    assert isclose(bandwidth, reference['bandwidth'], rtol=1e-6)
+    (binned, _) = histogram(x, n, (-5, 5))
+    (density, _, _) = kde1d_binned(binned, 5, dtype='float32')
+    assert density.dtype == 'float32'
+    assert isclose(density, expected, atol=1e-6*expected.max()).all()
+
+
+def test_workspace():
+    x = reference['x']
+    n = reference['n']
+    expected = reference['density']
+    workspace = Workspace(n)
+    out = empty(n)
+    (density, grid, bandwidth) = kde1d(x, n, 5, out=out, workspace=workspace)
+    assert density is out
+    assert isclose(density, expected).all()
+    assert isclose(bandwidth, reference['bandwidth'])
+    (density, _, _) = kde1d(x, n, 5, workspace=workspace)
+    assert density is not out
+    assert isclose(density, expected).all()
+    n = 2**16
+    (binned, _) = histogram(x, n, (-5, 5))
+    arguments = ({}, {'out': empty(n), 'workspace': Workspace(n)})
+    kde1d_binned(binned, 5, **arguments[1])
+    peaks = []
+    for keywords in arguments:
+        start()
+        kde1d_binned(binned, 5, **keywords)
+        peaks.append(get_traced_memory()[1])
+        stop()
+    assert peaks[1] < 2 * 8*n
+    assert peaks[0] > 8 * 8*n
+    with raises(ValueError):
+        kde1d_binned(binned, 5, workspace=Workspace(n, 'float32'))
+    with raises(ValueError):
+        kde1d(x, 2*n, 5, workspace=Workspace(n))
+
+
+def test_cache():
+    x = reference['x']
+    n = reference['n']
+    constants.clear()
+    (expected, _, _) = kde1d(x, n, 5)
+    statistics = constants.statistics()
+    assert statistics['squares'].misses == 1
+    assert statistics['factors'].misses == 1
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: kde1d(x, n, 5), range(8)))
+    for (density, _, _) in results:
+        assert (density == expected).all()
+    statistics = constants.statistics()
+    assert statistics['squares'].misses == 1
+    assert statistics['squares'].hits >= 8
+    with raises(ValueError):
+        constants.squares(int(n))[0] = 1
+    statistics = constants.statistics()
+    kde1d(x, 2*constants.limit, 5)
+    assert constants.statistics()['squares'] == statistics['squares']
+    assert constants.statistics()['indices'] == statistics['indices']
+
+
+def test_bandwidth():
+    x = reference['x']
+    n = reference['n']
+    expected = reference['bandwidth']
+    bandwidth = kde1d(x, n, 5, bandwidth_only=True)
+    assert isclose(bandwidth, expected)
+    (bandwidth, info) = kde1d(x, n, 5, full_output=True, bandwidth_only=True)
+    assert isclose(bandwidth, expected)
+    assert info.converged
+    (density, grid, bandwidth, info) = kde1d(x, n, 5, full_output=True,
+                                             bandwidth=expected)
+    assert isclose(density, reference['density']).all()
+    assert bandwidth == expected
+    assert info is None
+    (binned, _) = histogram(x, n, (-5, 5))
+    assert isclose(kde1d_binned(binned, 5, bandwidth_only=True), expected)
+    (density, _, _) = kde1d_binned(binned, 5, bandwidth=expected)
+    assert isclose(density, reference['density']).all()
+    with raises(ValueError):
+        kde1d(x, n, 5, bandwidth=0)
+    with raises(ValueError):
+        kde1d(x, n, 5, bandwidth=expected, bandwidth_only=True)
+
+
+def test_full_output():
+    x = reference['x']
+    (density, grid, bandwidth, info) = kde1d(x, 256, 5, full_output=True)
+    assert info.converged
+    assert info.iterations > 0
+    assert info.function_calls >= info.iterations
+    assert isclose(bandwidth, info.root**0.5 * 10)
+
+
+def test_guess():
+    x = reference['x']
+    n = reference['n']
+    (_, _, _, cold) = kde1d(x, n, 5, full_output=True)
+    for guess in (cold.root, 1.5*cold.root, cold.root/1.5):
+        (density, _, bandwidth, warm) = kde1d(x, n, 5, full_output=True,
+                                              guess=guess)
+        assert isclose(density, reference['density']).all()
+        assert isclose(bandwidth, reference['bandwidth'])
+        assert warm.function_calls < cold.function_calls
+    for guess in (0.099, 1e-9, 1):
+        (_, _, bandwidth, info) = kde1d(x, n, 5, full_output=True,
+                                        guess=guess)
+        assert isclose(bandwidth, reference['bandwidth'])
+        assert info.converged
+    (binned, _) = histogram(x, n, (-5, +5))
+    (density, _, _, warm) = kde1d_binned(binned, 5, full_output=True,
+                                         guess=cold.root)
+    assert isclose(density, reference['density']).all()
+    assert warm.function_calls < cold.function_calls
+    (bandwidth, info) = kde1d_binned(binned, 5, full_output=True,
+                                     bandwidth_only=True)
+    assert isclose(bandwidth, reference['bandwidth'])
+    assert info.function_calls == cold.function_calls
+
+
+def test_workers():
+    x = tile(reference['x'], 300)
+    (expected, _, _) = kde1d(x, 256, 5)
+    for workers in (2, 3, -1):
+        (density, _, _) = kde1d(x, 256, 5, workers=workers)
+        assert (density == expected).all()
+    with raises(ValueError):
+        kde1d(x, 256, 5, workers=0)
+    with set_workers(2):
+        (density, _, _) = kde1d(x, 256, 5)
+    assert (density == expected).all()
+
+
+def test_single_precision_data():
+    x = reference['x'].astype('float32')
+    x[0] = 0.7
+    limits = (0.7, 5)
+    (binned, _) = histogram(x.astype('float64'), 256, limits)
+    (expected, _, _) = kde1d_binned(binned, limits, len(x))
+    (density, _, _) = kde1d(x, 256, limits)
+    assert isclose(density, expected).all()
+
+
+def test_binned():
+    x = reference['x']
+    N = reference['N']
+    n = reference['n']
+    xmin = reference['xmin']
+    xmax = reference['xmax']
+    (binned, _) = histogram(x, n, (xmin, xmax))
+    (density, grid, bandwidth) = kde1d_binned(binned, (xmin, xmax), N)
+    assert isclose(density, reference['density']).all()
+    assert isclose(grid, reference['grid']).all()
+    assert isclose(bandwidth, reference['bandwidth']).all()
+    (density, grid, bandwidth) = kde1d_binned(list(binned), (xmin, xmax))
+    assert isclose(density, reference['density']).all()
+    (binned, _) = histogram(x, 300, (-5, 5))
+    (density, grid, bandwidth) = kde1d_binned(binned, 5)
+    assert len(density) == len(grid) == 300
+    with raises(ValueError):
+        kde1d_binned(binned, (None, 5))
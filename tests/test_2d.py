@@ -1,9 +1,12 @@
 ﻿"""Tests the 2d kernel density estimation."""
 
-from kde_diffusion import kde2d
+from kde_diffusion import kde2d, kde2d_binned, kdend, Workspace
 from pathlib       import Path
-from numpy         import isclose, load
+from numpy         import isclose, load, tile, histogram2d, column_stack
+from numpy         import empty
+from numpy.random  import default_rng
 from pytest        import raises
+from tracemalloc   import start, stop, get_traced_memory
 
 
 reference = None
@@ -63,3 +66,193 @@ def test_arguments():
         kde2d(samples, samples*2, 16)
     with raises(ValueError):
         kde2d(samples, samples, 16)
+
+
+def test_workers():
+    x = tile(reference['x'], 300)
+    y = tile(reference['y'], 300)
+    (expected, _, _) = kde2d(x, y, 64, 5)
+    for workers in (2, 3, -1):
+        (density, _, _) = kde2d(x, y, 64, 5, workers=workers)
+        assert (density == expected).all()
+    with raises(ValueError):
+        kde2d(x, y, 64, 5, workers=0)
+
+
+def test_binned():
+    x = reference['x']
+    y = reference['y']
+    N = reference['N']
+    n = reference['n']
+    xmin = reference['xmin']
+    xmax = reference['xmax']
+    ymin = reference['ymin']
+    ymax = reference['ymax']
+    limits = ((xmin, xmax), (ymin, ymax))
+    (binned, _, _) = histogram2d(x, y, n, limits)
+    (density, grid, bandwidth) = kde2d_binned(binned, limits, N)
+    assert isclose(density, reference['density']).all()
+    assert isclose(grid, reference['grid']).all()
+    assert isclose(bandwidth, reference['bandwidth']).all()
+    with raises(ValueError):
+        kde2d_binned(binned, (None, 5))
+    (binned, _, _) = histogram2d(x, y, (n, n//4), limits)
+    (density, grid, bandwidth) = kde2d_binned(binned, limits, N)
+    (expected, _, h) = kde2d(x, y, (n, n//4), limits)
+    assert isclose(density, expected).all()
+    assert isclose(bandwidth, h).all()
+
+
+def test_single_precision_data():
+    x = reference['x'].astype('float32')
+    y = reference['y'].astype('float32')
+    (x[0], y[0]) = (0.7, 0.7)
+    limits = ((0.7, 5), (0.7, 5))
+    (binned, _, _) = histogram2d(x.astype('float64'), y.astype('float64'),
+                                 64, limits)
+    (expected, _, _) = kde2d_binned(binned, limits, len(x))
+    (density, _, _) = kde2d(x, y, 64, limits)
+    assert isclose(density, expected).all()
+    (density, _, _) = kde2d(x, y, 64, limits, workspace=Workspace((64, 64)))
+    assert isclose(density, expected).all()
+
+
+def test_dtype():
+    x = reference['x']
+    y = reference['y']
+    n = reference['n']
+    limits = ((reference['xmin'], reference['xmax']),
+              (reference['ymin'], reference['ymax']))
+    (density, grid, bandwidth) = kde2d(x, y, n, limits, dtype='float32')
+    assert density.dtype == 'float32'
+    expected = reference['density']
+    assert isclose(density, expected, atol=1e-6*expected.max()).all()
+    assert isclose(bandwidth, reference['bandwidth'], rtol=1e-6).all()
+    (binned, _, _) = histogram2d(x, y, n, limits)
+    (density, _, _) = kde2d_binned(binned, limits, dtype='float32')
+    assert density.dtype == 'float32'
+    assert isclose(density, expected, atol=1e-6*expected.max()).all()
+
+
+def test_rectangular():
+    x = reference['x']
+    y = reference['y']
+    limits = ((reference['xmin'], reference['xmax']),
+              (reference['ymin'], reference['ymax']))
+    (density, grid, bandwidth) = kde2d(x, y, (256, 30), limits)
+    assert density.shape == (256, 32)
+    assert len(grid[0]) == 256
+    assert len(grid[1]) == 32
+    (expected, _, h) = kdend(column_stack((x, y)), (256, 32), limits)
+    assert isclose(density, expected).all()
+    assert isclose(bandwidth, h).all()
+    (transposed, _, h) = kde2d(y, x, (32, 256), limits[::-1])
+    assert isclose(density, transposed.T).all()
+    assert isclose(bandwidth, h[::-1]).all()
+    (density, grid, bandwidth) = kde2d(x, y, (300, 90), limits,
+                                       rounding='fast')
+    assert density.shape == (300, 90)
+    assert isclose(bandwidth, reference['bandwidth'], rtol=1e-2).all()
+
+
+def test_low_memory():
+    x = reference['x']
+    y = reference['y']
+    n = reference['n']
+    limits = ((reference['xmin'], reference['xmax']),
+              (reference['ymin'], reference['ymax']))
+    (density, grid, bandwidth) = kde2d(x, y, n, limits, low_memory=True)
+    expected = reference['density']
+    assert isclose(density, expected, atol=1e-12*expected.max()).all()
+    assert isclose(bandwidth, reference['bandwidth']).all()
+    generator = default_rng(0)
+    x = generator.normal(size=10**5)
+    y = generator.normal(size=10**5)
+    grid = 8 * 1024**2
+    peaks = []
+    for low_memory in (False, True):
+        start()
+        kde2d(x, y, 1024, 5, low_memory=low_memory)
+        peaks.append(get_traced_memory()[1])
+        stop()
+    assert peaks[1] < 2.75 * grid
+    assert peaks[0] > 4 * grid
+
+
+def test_workspace():
+    x = reference['x']
+    y = reference['y']
+    n = reference['n']
+    limits = ((reference['xmin'], reference['xmax']),
+              (reference['ymin'], reference['ymax']))
+    expected = reference['density']
+    workspace = Workspace((n, n))
+    out = empty((n, n))
+    (density, grid, bandwidth) = kde2d(x, y, n, limits, out=out,
+                                       workspace=workspace)
+    assert density is out
+    assert isclose(density, expected).all()
+    assert isclose(bandwidth, reference['bandwidth']).all()
+    (density, _, _) = kde2d(x, y, n, limits, workspace=workspace)
+    assert density is not out
+    assert isclose(density, expected).all()
+    binned = tile(workspace.counts, (4, 2))
+    workspace = Workspace(binned.shape)
+    out = empty(binned.shape)
+    kde2d_binned(binned, limits, out=out, workspace=workspace)
+    start()
+    kde2d_binned(binned, limits, out=out, workspace=workspace)
+    peak = get_traced_memory()[1]
+    stop()
+    assert peak < 8*binned.size / 2
+    with raises(ValueError):
+        kde2d(x, y, n, limits, workspace=workspace)
+
+
+def test_bandwidth():
+    x = reference['x']
+    y = reference['y']
+    n = reference['n']
+    limits = ((reference['xmin'], reference['xmax']),
+              (reference['ymin'], reference['ymax']))
+    expected = reference['bandwidth']
+    bandwidth = kde2d(x, y, n, limits, bandwidth_only=True)
+    assert isclose(bandwidth, expected).all()
+    (density, grid, bandwidth) = kde2d(x, y, n, limits,
+                                       bandwidth=tuple(expected))
+    assert isclose(density, reference['density']).all()
+    assert isclose(bandwidth, expected).all()
+    (binned, _, _) = histogram2d(x, y, n, limits)
+    bandwidth = kde2d_binned(binned, limits, bandwidth_only=True)
+    assert isclose(bandwidth, expected).all()
+    (density, _, bandwidth) = kde2d_binned(binned, limits, bandwidth=0.1)
+    assert isclose(bandwidth, 0.1).all()
+    with raises(ValueError):
+        kde2d(x, y, n, limits, bandwidth=(0.1, -0.1))
+
+
+def test_guess():
+    x = reference['x']
+    y = reference['y']
+    n = reference['n']
+    limits = ((reference['xmin'], reference['xmax']),
+              (reference['ymin'], reference['ymax']))
+    (density, _, bandwidth, cold) = kde2d(x, y, n, limits, full_output=True)
+    assert isclose(density, reference['density']).all()
+    assert cold.converged
+    (density, _, bandwidth, warm) = kde2d(x, y, n, limits, full_output=True,
+                                          guess=1.01*cold.root)
+    assert isclose(density, reference['density']).all()
+    assert isclose(bandwidth, reference['bandwidth']).all()
+    assert warm.function_calls < cold.function_calls
+    (binned, _, _) = histogram2d(x, y, n, limits)
+    (_, _, bandwidth) = kde2d_binned(binned, limits, guess=10*cold.root)
+    assert isclose(bandwidth, reference['bandwidth']).all()
+    (density, _, _, warm) = kde2d_binned(binned, limits, full_output=True,
+                                         guess=1.01*cold.root)
+    assert isclose(density, reference['density']).all()
+    assert warm.function_calls < cold.function_calls
+    (bandwidth, info) = kde2d_binned(binned, limits, full_output=True,
+                                     bandwidth_only=True)
+    assert isclose(bandwidth, reference['bandwidth']).all()
+    assert info.function_calls == cold.function_calls
@@ -0,0 +1,69 @@
+﻿"""Tests the batched kernel density estimation."""
+
+from kde_diffusion import kde1d, kde1d_batch
+from kde_diffusion import kde2d, kde2d_batch
+from numpy         import isclose
+from numpy.random  import default_rng
+from pytest        import raises
+
+
+def test_kde1d_batch():
+    random = default_rng(0)
+    samples = random.normal(size=(20, 100)) * random.uniform(1, 3, (20, 1))
+    (density, grid, bandwidth) = kde1d_batch(samples, 64)
+    assert density.shape == grid.shape == (20, 64)
+    assert bandwidth.shape == (20,)
+    for (i, x) in enumerate(samples):
+        (expected, xgrid, xbandwidth) = kde1d(x, 64)
+        assert isclose(density[i], expected).all()
+        assert isclose(grid[i], xgrid).all()
+        assert isclose(bandwidth[i], xbandwidth)
+    samples = [random.normal(size=size) for size in (50, 100, 200)]
+    (density, grid, bandwidth) = kde1d_batch(samples, 64, (-5, None))
+    for (i, x) in enumerate(samples):
+        (expected, xgrid, xbandwidth) = kde1d(x, 64, (-5, None))
+        assert isclose(density[i], expected).all()
+        assert isclose(grid[i], xgrid).all()
+        assert isclose(bandwidth[i], xbandwidth)
+    with raises(ValueError):
+        kde1d_batch([[-2, -1, 0, +1, +2]*20, [-2, -1, 0, +1, +2]*10], 4)
+    with raises(ValueError):
+        kde1d_batch([[-2, -1, 0, +1, +2], []], 4)
+
+
+def test_kde2d_batch():
+    random = default_rng(0)
+    samples = [(random.normal(size=size), random.normal(size=size))
+               for size in (100, 200, 400)]
+    (density, grid, bandwidth) = kde2d_batch(samples, 32)
+    assert density.shape == (3, 32, 32)
+    assert grid[0].shape == grid[1].shape == (3, 32)
+    assert bandwidth.shape == (3, 2)
+    for (i, (x, y)) in enumerate(samples):
+        (expected, (xgrid, ygrid), xybandwidth) = kde2d(x, y, 32)
+        assert isclose(density[i], expected).all()
+        assert isclose(grid[0][i], xgrid).all()
+        assert isclose(grid[1][i], ygrid).all()
+        assert isclose(bandwidth[i], xybandwidth).all()
+    (density, grid, bandwidth) = kde2d_batch(samples, 32, (None, 5))
+    for (i, (x, y)) in enumerate(samples):
+        (expected, _, xybandwidth) = kde2d(x, y, 32, (None, 5))
+        assert isclose(density[i], expected).all()
+        assert isclose(bandwidth[i], xybandwidth).all()
+    samples = [-2, -1, 0, +1, +2]
+    with raises(ValueError):
+        kde2d_batch([(samples*5, samples*5), (samples, samples*2)], 16)
+    with raises(ValueError):
+        kde2d_batch([(samples*5, samples*5), (samples, samples)], 16)
+
+
+def test_workers():
+    random = default_rng(0)
+    samples = random.normal(size=(20, 100))
+    (expected, _, _) = kde1d_batch(samples, 64)
+    (density, _, _) = kde1d_batch(samples, 64, workers=2)
+    assert isclose(density, expected).all()
+    samples = [(x, x[::-1]) for x in samples]
+    (expected, _, _) = kde2d_batch(samples, 16)
+    (density, _, _) = kde2d_batch(samples, 16, workers=-1)
+    assert isclose(density, expected).all()
@@ -0,0 +1,61 @@
+﻿"""Tests the kernel density estimation for data larger than memory."""
+
+from kde_diffusion import kde1d_chunked, kde2d_chunked, kde2d
+from pathlib       import Path
+from numpy         import isclose, load, save
+from pytest        import raises
+
+
+reference1d = None
+reference2d = None
+
+
+def setup_module():
+    global reference1d, reference2d
+    here = Path(__file__).parent
+    reference1d = load(here/'reference1d.npz')
+    reference2d = load(here/'reference2d.npz')
+
+
+def test_kde1d_chunked(tmp_path):
+    x = reference1d['x']
+    n = reference1d['n']
+    xmin = reference1d['xmin']
+    xmax = reference1d['xmax']
+    file = tmp_path/'x.npy'
+    save(file, x)
+    (density, grid, bandwidth) = kde1d_chunked(file, n, (xmin, xmax), 77)
+    assert isclose(density, reference1d['density']).all()
+    assert isclose(grid, reference1d['grid']).all()
+    assert isclose(bandwidth, reference1d['bandwidth']).all()
+    file = tmp_path/'x.raw'
+    x.astype('float32').tofile(file)
+    (density, grid, bandwidth) = kde1d_chunked(file, n, chunk=77,
+                                               format='float32')
+    assert isclose(grid.min(), x.min() - (x.max()-x.min())/10)
+    with raises(ValueError):
+        kde1d_chunked(file, n)
+
+
+def test_kde2d_chunked():
+    x = reference2d['x']
+    y = reference2d['y']
+    n = reference2d['n']
+    xmin = reference2d['xmin']
+    xmax = reference2d['xmax']
+    ymin = reference2d['ymin']
+    ymax = reference2d['ymax']
+    limits = ((xmin, xmax), (ymin, ymax))
+    (density, grid, bandwidth) = kde2d_chunked(x, y, n, limits, chunk=77)
+    assert isclose(density, reference2d['density']).all()
+    assert isclose(grid, reference2d['grid']).all()
+    assert isclose(bandwidth, reference2d['bandwidth']).all()
+    (density, grid, bandwidth) = kde2d_chunked(x, y, n, (None, 5), 77)
+    assert isclose(grid[0].min(), x.min() - (x.max()-x.min())/4)
+    assert isclose(grid[1].min(), -5)
+    (density, grid, bandwidth) = kde2d_chunked(x, y, (64, 16), limits, 77)
+    (expected, _, h) = kde2d(x, y, (64, 16), limits)
+    assert isclose(density, expected).all()
+    assert isclose(bandwidth, h).all()
+    with raises(ValueError):
+        kde2d_chunked(x, y[:-1], n)
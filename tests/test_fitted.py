@@ -0,0 +1,168 @@
+﻿"""Tests the fitted density estimates."""
+
+from kde_diffusion import KDE1d, KDE2d, kde2d
+from pathlib       import Path
+from numpy         import isclose, load, meshgrid, histogram, array
+from numpy         import linspace, interp, histogram2d
+from numpy         import diff, cumsum, concatenate, median, quantile
+from numpy.random  import default_rng
+
+
+reference1d = None
+reference2d = None
+
+
+def setup_module():
+    global reference1d, reference2d
+    here = Path(__file__).parent
+    reference1d = load(here/'reference1d.npz')
+    reference2d = load(here/'reference2d.npz')
+
+
+def test_kde1d():
+    x = reference1d['x']
+    n = reference1d['n']
+    xmin = reference1d['xmin']
+    xmax = reference1d['xmax']
+    kde = KDE1d.fit(x, n, (xmin, xmax))
+    grid = reference1d['grid']
+    density = reference1d['density']
+    assert isclose(kde.grid, grid).all()
+    assert isclose(kde.bandwidth, reference1d['bandwidth'])
+    assert isclose(kde(grid), density).all()
+    assert isclose(kde(grid, exact=True), density).all()
+    points = linspace(xmin, xmax, 1000)
+    assert isclose(kde(points), interp(points, grid, density)).all()
+    assert (abs(kde(points) - kde(points, exact=True)) < 1e-3).all()
+    assert (kde(array([xmin - 1, xmax + 1])) == 0).all()
+    assert kde(points.reshape(10, 100)).shape == (10, 100)
+    (binned, _) = histogram(x, n, (xmin, xmax))
+    other = KDE1d.from_binned(binned, (xmin, xmax))
+    assert isclose(other(points), kde(points)).all()
+
+
+def test_kde2d():
+    x = reference2d['x']
+    y = reference2d['y']
+    n = reference2d['n']
+    xmin = reference2d['xmin']
+    xmax = reference2d['xmax']
+    ymin = reference2d['ymin']
+    ymax = reference2d['ymax']
+    limits = ((xmin, xmax), (ymin, ymax))
+    kde = KDE2d.fit(x, y, n, limits)
+    density = reference2d['density']
+    assert isclose(kde.bandwidth, reference2d['bandwidth']).all()
+    (gx, gy) = meshgrid(*kde.grid, indexing='ij')
+    assert isclose(kde(gx, gy), density).all()
+    assert isclose(kde(gx, gy, exact=True, chunk=1000), density).all()
+    px = linspace(xmin, xmax, 50)
+    py = linspace(ymin, ymax, 50)
+    difference = kde(px, py) - kde(px, py, exact=True)
+    assert (abs(difference) < 1e-2 * density.max()).all()
+    assert kde(xmax + 1, ymin) == 0
+    (binned, _, _) = histogram2d(x, y, n, limits)
+    other = KDE2d.from_binned(binned, limits)
+    assert isclose(other(px, py), kde(px, py)).all()
+
+
+def test_sample():
+    x = reference1d['x']
+    n = reference1d['n']
+    limits = (reference1d['xmin'], reference1d['xmax'])
+    kde = KDE1d.fit(x, n, limits)
+    samples = kde.sample(10**6, rng=1)
+    assert (samples == kde.sample(10**6, rng=default_rng(1))).all()
+    assert (samples >= limits[0]).all()
+    assert (samples <= limits[1]).all()
+    Δ = (limits[1] - limits[0]) / n
+    (counts, _) = histogram(samples, n, limits, density=True)
+    expected = kde(kde.grid + Δ/2)
+    assert (abs(counts - expected) < 0.05 * kde.density.max()).all()
+    q = linspace(0.01, 0.99, 99)
+    assert (abs(quantile(samples, q) - kde.quantile(q)) < Δ/5).all()
+    assert kde.sample((2, 3)).shape == (2, 3)
+    assert kde.sample().shape == ()
+    x = reference2d['x']
+    y = reference2d['y']
+    limits = ((reference2d['xmin'], reference2d['xmax']),
+              (reference2d['ymin'], reference2d['ymax']))
+    kde = KDE2d.fit(x, y, 32, limits)
+    (xs, ys) = kde.sample(10**6, rng=2)
+    Δ = [(upper - lower)/32 for (lower, upper) in limits]
+    (counts, _, _) = histogram2d(xs, ys, 32, limits, density=True)
+    centers = meshgrid(kde.grid[0] + Δ[0]/2, kde.grid[1] + Δ[1]/2,
+                       indexing='ij')
+    expected = kde(*centers)
+    assert (abs(counts - expected) < 0.05 * kde.density.max()).all()
+    for (axis, samples) in enumerate((xs, ys)):
+        marginal = kde.marginal(axis)
+        error = abs(quantile(samples, q) - marginal.quantile(q))
+        assert (error < Δ[axis]/5).all()
+    (xs, ys) = kde.sample((4, 5))
+    assert xs.shape == ys.shape == (4, 5)
+
+
+def test_sample_boundary():
+    rng = default_rng(3)
+    (x, y) = rng.exponential(size=(2, 5000))
+    q = linspace(0.01, 0.99, 99)
+    kde = KDE1d.fit(x, 256, (0, 8))
+    samples = kde.sample(10**6, rng=4)
+    assert (samples > 0).all()
+    Δ = 8/256
+    assert (abs(quantile(samples, q) - kde.quantile(q)) < Δ/5).all()
+    kde = KDE2d.fit(x, y, 64, ((0, 8), (0, 8)))
+    (xs, ys) = kde.sample(10**6, rng=5)
+    Δ = 8/64
+    for (axis, samples) in enumerate((xs, ys)):
+        marginal = kde.marginal(axis)
+        error = abs(quantile(samples, q) - marginal.quantile(q))
+        assert (error < Δ/5).all()
+
+
+def test_cdf():
+    x = reference1d['x']
+    n = reference1d['n']
+    (xmin, xmax) = (reference1d['xmin'], reference1d['xmax'])
+    kde = KDE1d.fit(x, n, (xmin, xmax))
+    points = linspace(xmin, xmax, 10001)
+    cdf = kde.cdf(points)
+    assert isclose(cdf[0], 0)
+    assert isclose(cdf[-1], 1)
+    assert (diff(cdf) >= 0).all()
+    assert isclose(cdf, kde.cdf(points, exact=True), atol=1e-6).all()
+    density = kde(points, exact=True)
+    steps = (density[1:] + density[:-1])/2 * diff(points)
+    integral = concatenate(([0], cumsum(steps))) / kde.mass
+    assert isclose(cdf, integral, atol=1e-6).all()
+    assert isclose(kde.cdf(median(x)), 0.5, atol=0.02)
+    assert kde.cdf(xmin - 1) == 0
+    assert kde.cdf(xmax + 1) == 1
+    q = linspace(0, 1, 101)
+    assert isclose(kde.cdf(kde.quantile(q)), q).all()
+    assert kde.quantile(q.reshape(1, 101)).shape == (1, 101)
+    assert isclose(kde.probability(xmin, xmax), 1)
+    assert isclose(kde.probability(-1, 1), kde.cdf(1) - kde.cdf(-1))
+
+
+def test_marginal():
+    x = reference2d['x']
+    y = reference2d['y']
+    n = reference2d['n']
+    limits = ((reference2d['xmin'], reference2d['xmax']),
+              (reference2d['ymin'], reference2d['ymax']))
+    kde = KDE2d.fit(x, y, n, limits)
+    (density, _, _) = kde2d(x, y, n, limits)
+    marginal = kde.marginal(0)
+    assert isclose(marginal.grid, kde.grid[0]).all()
+    assert marginal.limits == limits[0]
+    Δy = limits[1][1] - limits[1][0]
+    assert isclose(marginal.density, density.sum(axis=1) * Δy/n).all()
+    assert isclose(marginal.bandwidth, kde.bandwidth[0])
+    points = kde.grid[0]
+    integral = kde(points[:, None], kde.grid[1], exact=True).sum(axis=1)
+    assert isclose(marginal(points), integral * Δy/n).all()
+    marginal = kde.marginal(1)
+    assert marginal.limits == limits[1]
+    assert isclose(marginal.bandwidth, kde.bandwidth[1])
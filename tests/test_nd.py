@@ -0,0 +1,80 @@
+﻿"""Tests the kernel density estimation in d dimensions."""
+
+from kde_diffusion import kdend, kde2d
+from kde_diffusion.binning import histogramdd
+from pathlib       import Path
+from numpy         import isclose, load, column_stack, histogramdd as numpy
+from numpy         import array, prod
+from numpy.random  import default_rng
+from pytest        import raises
+
+
+reference1d = None
+reference2d = None
+
+
+def setup_module():
+    global reference1d, reference2d
+    here = Path(__file__).parent
+    reference1d = load(here/'reference1d.npz')
+    reference2d = load(here/'reference2d.npz')
+
+
+def test_reference():
+    x = reference1d['x']
+    n = reference1d['n']
+    limits = [(reference1d['xmin'], reference1d['xmax'])]
+    (density, grid, bandwidth) = kdend(x[:, None], n, limits)
+    assert isclose(density, reference1d['density']).all()
+    assert isclose(grid[0], reference1d['grid']).all()
+    assert isclose(bandwidth, reference1d['bandwidth']).all()
+    x = reference2d['x']
+    y = reference2d['y']
+    n = reference2d['n']
+    limits = ((reference2d['xmin'], reference2d['xmax']),
+              (reference2d['ymin'], reference2d['ymax']))
+    (density, grid, bandwidth) = kdend(column_stack((x, y)), n, limits)
+    assert isclose(density, reference2d['density']).all()
+    assert isclose(grid[0], reference2d['grid'][0]).all()
+    assert isclose(grid[1], reference2d['grid'][1]).all()
+    assert isclose(bandwidth, reference2d['bandwidth']).all()
+    (density, grid, bandwidth) = kdend(column_stack((x, y)), 64)
+    (expected, _, h) = kde2d(x, y, 64)
+    assert isclose(density, expected).all()
+    assert isclose(bandwidth, h).all()
+
+
+def test_dimensions():
+    σ = array([1, 2, 0.5])
+    samples = default_rng(1).normal(size=(10000, 3)) * σ
+    limits = [5*σm for σm in σ]
+    (density, grid, bandwidth) = kdend(samples, (32, 64, 17), limits)
+    assert density.shape == (32, 64, 32)
+    assert [len(axis) for axis in grid] == [32, 64, 32]
+    volume = prod([axis[1] - axis[0] for axis in grid])
+    assert isclose(density.sum() * volume, 1)
+    ratios = bandwidth / σ
+    assert isclose(ratios, ratios.mean(), rtol=0.1).all()
+    with raises(MemoryError):
+        kdend(samples, 1024, memory=2**30)
+    with raises(ValueError):
+        kdend(samples, (32, 32))
+    with raises(ValueError):
+        kdend(samples, 32, limits=(1, 2))
+
+
+def test_histogramdd():
+    samples = default_rng(2).normal(size=(10000, 3))
+    bins = (8, 16, 4)
+    limits = [(-3, 3), (-2, 4), (-1, 1)]
+    (counts, edges) = histogramdd(samples, bins, limits)
+    (expected, expected_edges) = numpy(samples, bins, limits)
+    assert (counts == expected).all()
+    for (axis, expected_axis) in zip(edges, expected_edges):
+        assert (axis == expected_axis).all()
+    samples = samples.astype('float32')
+    samples[0] = 0.7
+    limits = [(0.7, 3), (0.7, 4), (-1, 0.7)]
+    (counts, _) = histogramdd(samples, bins, limits)
+    (expected, _) = numpy(samples.astype('float64'), bins, limits)
+    assert (counts == expected).all()
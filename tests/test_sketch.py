@@ -0,0 +1,75 @@
+﻿"""Tests the mergeable histogram sketches."""
+
+from kde_diffusion import kde1d, kde2d, Sketch1d, Sketch2d
+from pathlib       import Path
+from numpy         import isclose, load, array_split
+from functools     import reduce
+from pytest        import raises
+
+
+reference1d = None
+reference2d = None
+
+
+def setup_module():
+    global reference1d, reference2d
+    here = Path(__file__).parent
+    reference1d = load(here/'reference1d.npz')
+    reference2d = load(here/'reference2d.npz')
+
+
+def test_sketch1d():
+    x = reference1d['x']
+    n = reference1d['n']
+    limits = (reference1d['xmin'], reference1d['xmax'])
+    sketches = [Sketch1d(limits, n).partial_fit(chunk)
+                for chunk in array_split(x, 5)]
+    data = [sketch.to_bytes() for sketch in sketches]
+    assert all(len(blob) < n*8 for blob in data)
+    sketches = [Sketch1d.from_bytes(blob) for blob in data]
+    merged = reduce(Sketch1d.merge, sketches)
+    assert len(x) == merged.N
+    (density, grid, bandwidth) = merged.finalize()
+    assert isclose(density, reference1d['density']).all()
+    assert isclose(grid, reference1d['grid']).all()
+    assert isclose(bandwidth, reference1d['bandwidth']).all()
+    with raises(ValueError):
+        merged.merge(Sketch1d(limits, n//2))
+    with raises(ValueError):
+        merged.merge(Sketch1d(4, n))
+    with raises(ValueError):
+        Sketch2d.from_bytes(data[0])
+
+
+def test_sketch2d():
+    x = reference2d['x']
+    y = reference2d['y']
+    n = reference2d['n']
+    limits = ((reference2d['xmin'], reference2d['xmax']),
+              (reference2d['ymin'], reference2d['ymax']))
+    sketches = [Sketch2d(limits, n).partial_fit(xc, yc)
+                for (xc, yc) in zip(array_split(x, 5), array_split(y, 5))]
+    sketches = [Sketch2d.from_bytes(sketch.to_bytes()) for sketch in sketches]
+    merged = reduce(Sketch2d.merge, sketches)
+    (density, grid, bandwidth) = merged.finalize()
+    assert isclose(density, reference2d['density']).all()
+    assert isclose(grid, reference2d['grid']).all()
+    assert isclose(bandwidth, reference2d['bandwidth']).all()
+    (expected, _, _) = kde2d(x, y, 16, 5)
+    (density, _, _) = Sketch2d(5, 16).partial_fit(x, y).density()
+    assert isclose(density, expected).all()
+    (expected, _, _) = kde2d(x, y, (32, 8), 5)
+    sketch = Sketch2d(5, (32, 8)).partial_fit(x, y)
+    (density, _, _) = Sketch2d.from_bytes(sketch.to_bytes()).density()
+    assert isclose(density, expected).all()
+    with raises(ValueError):
+        sketch.merge(Sketch2d(5, 32))
+    (expected, _, _) = kde1d(x, 16, 5)
+    (density, _, _) = Sketch1d(5, 16).partial_fit(x).density()
+    assert isclose(density, expected).all()
+    with raises(ValueError):
+        Sketch2d((5, None))
+    with raises(ValueError):
+        Sketch2d(5).partial_fit(x, y[:-1])
+    with raises(ValueError):
+        Sketch2d(5).density()
@@ -0,0 +1,103 @@
+﻿"""Tests the kernel density estimation for streamed data."""
+
+from kde_diffusion import kde1d, kde1d_binned
+from kde_diffusion import StreamingKDE1d, SlidingKDE1d, DecayedKDE1d
+from pathlib       import Path
+from numpy         import isclose, load, array_split, zeros, histogram
+from pytest        import raises
+
+
+reference = None
+
+
+def setup_module():
+    global reference
+    here = Path(__file__).parent
+    reference = load(here/'reference1d.npz')
+
+
+def test_streaming():
+    x = reference['x']
+    n = reference['n']
+    xmin = reference['xmin']
+    xmax = reference['xmax']
+    estimator = StreamingKDE1d((xmin, xmax), n)
+    for chunk in array_split(x, 7):
+        estimator.partial_fit(chunk)
+    assert len(x) == estimator.N
+    (density, grid, bandwidth) = estimator.density()
+    assert isclose(density, reference['density']).all()
+    assert isclose(grid, reference['grid']).all()
+    assert isclose(bandwidth, reference['bandwidth']).all()
+    estimator = StreamingKDE1d(2, 4).partial_fit([-2, -1, 0, +1, +2]*20)
+    (density, grid, bandwidth) = estimator.density()
+    (expected, _, _) = kde1d([-2, -1, 0, +1, +2]*20, 4, 2)
+    assert isclose(density, expected).all()
+    with raises(ValueError):
+        StreamingKDE1d((None, 2))
+    with raises(ValueError):
+        StreamingKDE1d(2).density()
+
+
+def test_sliding():
+    x = reference['x']
+    n = reference['n']
+    limits = (reference['xmin'], reference['xmax'])
+    window = 300
+    estimator = SlidingKDE1d(limits, window, n)
+    for stop in range(100, len(x)+1, 100):
+        estimator.partial_fit(x[stop-100:stop])
+        assert min(stop, window) == estimator.N
+        (density, grid, bandwidth) = estimator.density()
+        (expected, _, h) = kde1d(x[max(0, stop-window):stop], n, limits)
+        assert isclose(density, expected).all()
+        assert isclose(bandwidth, h)
+    assert isclose(grid, reference['grid']).all()
+    estimator.partial_fit(x)
+    (density, _, _) = estimator.density()
+    (expected, _, _) = kde1d(x[-window:], n, limits)
+    assert isclose(density, expected).all()
+    with raises(ValueError):
+        SlidingKDE1d(2, 10).density()
+
+
+def test_decayed():
+    x = reference['x']
+    n = reference['n']
+    limits = (reference['xmin'], reference['xmax'])
+    estimator = DecayedKDE1d(limits, float('inf'), n)
+    for chunk in array_split(x, 7):
+        estimator.partial_fit(chunk)
+    assert isclose(estimator.N, len(x))
+    (density, _, bandwidth) = estimator.density()
+    assert isclose(density, reference['density']).all()
+    assert isclose(bandwidth, reference['bandwidth'])
+    half_life = 2
+    estimator = DecayedKDE1d(limits, half_life, n)
+    weighted = zeros(n)
+    (total, squares) = (0, 0)
+    for (time, chunk) in enumerate(array_split(x, 200)):
+        estimator.partial_fit(chunk, time)
+        decay = 2**(-1/half_life)
+        weighted = weighted*decay + histogram(chunk, n, limits)[0]
+        total   = total*decay + len(chunk)
+        squares = squares*decay**2 + len(chunk)
+    assert estimator.origin > 0
+    N = total**2 / squares
+    assert isclose(estimator.N, N)
+    (density, _, bandwidth) = estimator.density()
+    (expected, _, h) = kde1d_binned(weighted * N/total, limits, N)
+    assert isclose(density, expected).all()
+    assert isclose(bandwidth, h)
+    estimator = DecayedKDE1d(limits, 60, n)
+    estimator.partial_fit(x[:100], time=1.7e9)
+    for gap in (1e6, 6e4):
+        estimator.partial_fit(x[100:], time=estimator.now + gap)
+        assert isclose(estimator.N, len(x) - 100)
+    (density, _, bandwidth) = estimator.density()
+    (binned, _) = histogram(x[100:], n, limits)
+    (expected, _, h) = kde1d_binned(binned, limits)
+    assert isclose(density, expected, atol=1e-12).all()
+    assert isclose(bandwidth, h)
+    with raises(ValueError):
+        DecayedKDE1d(2, 1).density()